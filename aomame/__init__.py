@@ -3,5 +3,9 @@ from aomame.microsoft import MicrosoftTranslator
 from aomame.systran import SystranTranslator
 from aomame.google import GoogleTranslator
 from aomame.google_asr import GoogleASR
+from aomame.router import RouterTranslator
+from aomame.cache import TranslationCache
+from aomame.ratelimit import RateLimiter
+from aomame.metrics import Metrics
 #from aomame.modernmt import ModernmtTranslator
 #from aomame.deepl import DeeplTranslator
@@ -0,0 +1,535 @@
+"""
+Asyncio counterparts of the aomame clients, built on aiohttp.
+
+They take the same constructor arguments as their blocking counterparts plus
+`max_concurrency`, the number of requests a client keeps in flight, and
+follow the same batching, caching, deduplication and retry rules. Every
+public method is a coroutine, without the `quiet`, `max_workers` and
+`workers` arguments of the blocking one. Cancelling a task cancels its
+in-flight requests.
+
+    async with AsyncGoogleTranslator(host, key) as gt:
+        translations = await gt.translate_sents(texts, 'zh', 'en')
+"""
+import asyncio
+import inspect
+import itertools
+import json
+import time
+
+try:
+    import aiohttp
+except ImportError: # pragma: no cover
+    aiohttp = None
+
+from aomame.batching import MICROSOFT_DETECT_LIMITS, check_batch, plan_batches
+from aomame.exceptions import ResponseError
+from aomame.google import GoogleTranslator
+from aomame.google_asr import GoogleASR, list_files
+from aomame.microsoft import MicrosoftTranslator, parse_languages, parse_scripts
+from aomame.systran import SystranTranslator, is_input_error
+from aomame.segment import chunk_text, join_segments, segment_text
+from aomame.utils import UNDETERMINED, dedupe, read_cached_json, write_cached_json
+
+
+def _truncate(limits):
+    """Split for _translate_batches() keeping only the start of a text."""
+    async def split(text):
+        return [text[:limits.max_segment_chars()]]
+    return split
+
+
+def _first(segments, results):
+    return results[0]
+
+
+class _Response:
+    """The parts of a requests.Response that the clients use."""
+    def __init__(self, status_code, headers, content):
+        self.status_code, self.headers, self.content = status_code, headers, content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class _AsyncClient:
+    """Event-loop side of the async clients: the aiohttp session, the
+    concurrency semaphore and the retry loop."""
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # A public method inherited from the blocking client as is would call
+        # the async api_call() without awaiting it.
+        blocking = [name for name, method in inspect.getmembers(cls, callable)
+                    if not name.startswith('_') and not inspect.iscoroutinefunction(method)]
+        if blocking:
+            raise TypeError(f"{cls.__name__} has no async {', '.join(blocking)}")
+
+    def _init_async(self, max_concurrency, session):
+        if aiohttp is None:
+            raise ImportError("The async clients need aiohttp, `pip install aomame[async]`")
+        self.max_concurrency = max_concurrency
+        # The blocking session set up by the parent class is never used.
+        self.session, self._owns_session = session, session is None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _get_session(self):
+        # Created lazily, aiohttp sessions must be created inside the event loop.
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.session
+
+    async def close(self):
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _request(self, http_method, method, url, chars=0, **kwargs):
+        session = self._get_session()
+        metrics = self.metrics if self.metrics.enabled else None
+        async with self._semaphore:
+            for attempt in itertools.count():
+                wait = self.rate_limiter.reserve(chars)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                start = time.perf_counter()
+                try:
+                    async with session.request(http_method, url, headers=self.headers,
+                                               **kwargs) as r:
+                        response = _Response(r.status, r.headers, await r.read())
+                        sent_url = r.url
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if metrics:
+                        metrics.request(self.provider, method, None,
+                                        time.perf_counter() - start, 0, 0, chars)
+                    status, delay = None, self.rate_limiter.error_delay(attempt)
+                    if delay is None:
+                        raise
+                else:
+                    if metrics:
+                        # Serialising the payload again is only worth it for the metrics.
+                        sent = len(str(sent_url)) + (len(json.dumps(kwargs['json']))
+                                                     if kwargs.get('json') is not None
+                                                     else len(kwargs.get('data') or b''))
+                        metrics.request(self.provider, method, response.status_code,
+                                        time.perf_counter() - start, sent,
+                                        len(response.content), chars)
+                    status = response.status_code
+                    delay = self.rate_limiter.retry_delay(response, attempt)
+                    if delay is None:
+                        return response
+                if metrics:
+                    metrics.retry(self.provider, method, status, delay)
+                await asyncio.sleep(delay)
+
+    async def api_call(self, http_method, method, params=None, json=None, chars=0):
+        """Wrapper class over API calls."""
+        url = self.urls[method] + params if params else self.urls[method]
+        return await self._request(http_method, method, url, chars=chars, json=json)
+
+    async def detect(self, text):
+        return (await self.detect_sents([text]))[0]
+
+    async def detect_sents(self, texts):
+        """Detect the language of a list of texts, see the blocking
+        detect_sents(). Repeated and cached texts are not sent."""
+        async def detect(misses):
+            return [(language,) for language in await self._detect(misses)]
+        uniques, positions = dedupe(texts)
+        results = await self._cached(f'{self.provider}:detect', uniques, '', [''], detect)
+        return [results[i][0] for i in positions]
+
+    async def translate(self, text, srclang, trglang):
+        return (await self.translate_sents([text], srclang, trglang))[0]
+
+    async def translate_sents(self, texts, srclang, trglang, normalize_whitespace=False):
+        """Translate a list of texts, all batches concurrently. Repeated and
+        cached texts are not sent. With srclang='auto' the texts are grouped
+        by detected language, see utils.translate_detected()."""
+        if srclang == 'auto':
+            translations = await self._translate_detected(texts, [trglang], normalize_whitespace)
+            return translations[trglang]
+        results = await self._translate_unique(
+            texts, srclang, [trglang],
+            lambda misses: self._translate_sents_multi(misses, srclang, [trglang]),
+            normalize_whitespace=normalize_whitespace)
+        return [result[0] for result in results]
+
+    async def translate_sents_multi(self, texts, srclang, trglangs, normalize_whitespace=False):
+        """Translate a list of texts into several target languages, one
+        concurrent translate_sents() per target.
+        Returns:
+            A {trglang: translations} dict.
+        """
+        if srclang == 'auto':
+            return await self._translate_detected(texts, trglangs, normalize_whitespace)
+        results = await asyncio.gather(
+            *[self.translate_sents(texts, srclang, trglang,
+                                   normalize_whitespace=normalize_whitespace)
+              for trglang in trglangs])
+        return dict(zip(trglangs, results))
+
+    async def _translate_detected(self, texts, trglangs, normalize_whitespace=False):
+        """Async counterpart of utils.translate_detected_multi()."""
+        languages = await self.detect_sents(texts)
+        groups = {}
+        for i, language in enumerate(languages):
+            groups.setdefault(language, []).append(i)
+        sources = [language for language in groups
+                   if language not in UNDETERMINED and set(trglangs) - {language}]
+        results = {trglang: list(texts) for trglang in trglangs}
+        groups_translations = await asyncio.gather(
+            *[self.translate_sents_multi(
+                [texts[i] for i in groups[language]], language,
+                [trglang for trglang in trglangs if trglang != language],
+                normalize_whitespace=normalize_whitespace)
+              for language in sources])
+        for language, translations in zip(sources, groups_translations):
+            for trglang, group in translations.items():
+                for i, translation in zip(groups[language], group):
+                    results[trglang][i] = translation
+        return results
+
+    async def _translate_sents_multi(self, texts, srclang, trglangs):
+        # A tuple of translations per text, one per target.
+        results = await asyncio.gather(
+            *[self._translate_sents(texts, srclang, trglang) for trglang in trglangs])
+        return list(zip(*results))
+
+    async def _translate_sents(self, texts, srclang, trglang):
+        return await self._translate_batches(
+            texts, self.batch_limits,
+            lambda batch: self._translate_batch(batch, srclang, trglang), self._split)
+
+    async def _split(self, text):
+        return segment_text(text, self.batch_limits.max_segment_chars())
+
+    async def _translate_batches(self, texts, limits, translate_batch, split, join=join_segments):
+        """Async counterpart of batching.translate_batches(): texts too large
+        for a batch are cut into segments with `await split(text)`, which are
+        batched with the other texts, and all batches are sent concurrently."""
+        segments, spans = [], []
+        for text in texts:
+            parts = [text] if limits.fits_text(text) else await split(text)
+            spans.append((len(segments), len(segments) + len(parts)))
+            segments.extend(parts)
+
+        async def send(batch):
+            with self.metrics.batch(self.provider, batch, limits):
+                return await translate_batch(batch)
+
+        batches, _ = plan_batches(segments, limits)
+        results = await asyncio.gather(*[send([segments[i] for i in batch]) for batch in batches])
+        translations = [None] * len(segments)
+        for batch, result in zip(batches, results):
+            check_batch(batch, result)
+            for i, translation in zip(batch, result):
+                translations[i] = translation
+        return [join(segments[start:end], translations[start:end]) for start, end in spans]
+
+    async def _translate_unique(self, texts, srclang, trglangs, translate,
+                                normalize_whitespace=False):
+        """Async counterpart of utils.translate_unique() with the cache lookup
+        of cache.cached_translate_sents_multi(), `translate(misses)` returns
+        a tuple of translations per text, one per target."""
+        uniques, positions = dedupe(texts, normalize_whitespace)
+        results = await self._cached(self.provider, uniques, srclang, trglangs, translate)
+        self.metrics.deduplicated(self.provider, (sum(map(len, texts)) - sum(map(len, uniques)))
+                                  * len(trglangs))
+        return [results[i] for i in positions]
+
+    async def _cached(self, provider, texts, srclang, trglangs, translate):
+        # The cache is read and written on a worker thread, its SQLite file
+        # would block the event loop.
+        if self.cache is None:
+            return await translate(texts)
+        found = await asyncio.to_thread(
+            lambda: {trglang: self.cache.get_many(provider, srclang, trglang, texts)
+                     for trglang in trglangs})
+        misses = [t for t in texts if any(t not in found[trglang] for trglang in trglangs)]
+        if misses:
+            results = await translate(misses)
+            for k, trglang in enumerate(trglangs):
+                found[trglang].update(zip(misses, [result[k] for result in results]))
+            await asyncio.to_thread(
+                lambda: [self.cache.set_many(provider, srclang, trglang, misses,
+                                             [result[k] for result in results])
+                         for k, trglang in enumerate(trglangs)])
+        return [tuple(found[trglang][t] for trglang in trglangs) for t in texts]
+
+    async def _cached_json(self, fetch):
+        """Async counterpart of utils.cached_json() for the metadata file,
+        read and written on a worker thread like the cache."""
+        path = self._metadata_path()
+        document = await asyncio.to_thread(read_cached_json, path, self.metadata_ttl)
+        if document is None:
+            document = await fetch()
+            if path:
+                await asyncio.to_thread(write_cached_json, path, document)
+        return document
+
+
+class AsyncMicrosoftTranslator(_AsyncClient, MicrosoftTranslator):
+    """Asyncio counterpart of MicrosoftTranslator."""
+    def __init__(self, host, key, max_concurrency=10, session=None, **kwargs):
+        MicrosoftTranslator.__init__(self, host, key, **kwargs)
+        self._init_async(max_concurrency, session)
+        self._metadata_lock = asyncio.Lock()
+
+    async def metadata(self):
+        """Return the response of the languages endpoint, fetched at most once."""
+        async with self._metadata_lock:
+            if self._metadata is None:
+                self._metadata = await self._cached_json(self._fetch_metadata)
+            return self._metadata
+
+    async def _fetch_metadata(self):
+        response = await self.api_call('GET', 'languages')
+        if response.status_code != 200:
+            raise ResponseError(response.json())
+        return response.json()
+
+    async def languages(self):
+        return parse_languages(await self.metadata())
+
+    async def scripts(self):
+        return parse_scripts(await self.metadata())
+
+    async def transliterate(self, text, srclang, from_script, to_script):
+        params = f'&language={srclang}&fromScript={from_script}&toScript={to_script}'
+        response = await self.api_call('POST', 'transliterate', params=params,
+                                       json=[{'Text': text}], chars=len(text))
+        if response.status_code == 200:
+            return response.json()[0]['text']
+        else:
+            raise ResponseError(response.json())
+
+    async def break_sent(self, text, srclang):
+        params = f'&language={srclang}'
+        response = await self.api_call('POST', 'breaksentence', params=params,
+                                       json=[{'Text': text}], chars=len(text))
+        if response.status_code == 200:
+            start = 0
+            sentences = []
+            for sentlen in response.json()[0]['sentLen']:
+                sentences.append(text[start:start+sentlen])
+                start += sentlen
+            return sentences
+        else:
+            raise ResponseError(response.json())
+
+    async def segment(self, text, srclang, max_chars=None):
+        sentences = None
+        if self.segmenter == 'remote':
+            # See MicrosoftTranslator.segment()
+            chunks = chunk_text(text, self.batch_limits.max_chars)
+            sentences = [sentence for sentences in await asyncio.gather(
+                *[self.break_sent(chunk, srclang) for chunk in chunks]) for sentence in sentences]
+        return segment_text(text, max_chars or self.batch_limits.max_chars, sentences)
+
+    async def _detect(self, texts):
+        # The start of a text too long for a request is enough to detect it.
+        return await self._translate_batches(
+            texts, MICROSOFT_DETECT_LIMITS, self._detect_batch,
+            _truncate(MICROSOFT_DETECT_LIMITS), join=_first)
+
+    async def _detect_batch(self, batch):
+        response = await self.api_call('POST', 'detect', json=[{'Text': t} for t in batch],
+                                       chars=sum(map(len, batch)))
+        if response.status_code == 200:
+            return [d['language'] for d in response.json()]
+        else:
+            raise ResponseError(response.json())
+
+    async def _translate_batch(self, batch, srclang, trglang):
+        return [ts[0] for ts in await self._translate_batch_multi(batch, srclang, [trglang])]
+
+    async def _translate_batch_multi(self, batch, srclang, trglangs):
+        params = f'&from={srclang}' + ''.join(f'&to={trglang}' for trglang in trglangs)
+        response = await self.api_call('POST', 'translate', params=params,
+                                       json=[{'Text': t} for t in batch],
+                                       chars=sum(map(len, batch)) * len(trglangs))
+        if response.status_code == 200:
+            return [tuple(t['text'] for t in item['translations']) for item in response.json()]
+        else:
+            raise ResponseError(response.json())
+
+    async def translate_sents_multi(self, texts, srclang, trglangs, normalize_whitespace=False):
+        """See MicrosoftTranslator.translate_sents_multi()"""
+        if srclang == 'auto':
+            return await self._translate_detected(texts, trglangs, normalize_whitespace)
+        results = await self._translate_unique(
+            texts, srclang, trglangs,
+            lambda misses: self._translate_sents_multi(misses, srclang, trglangs),
+            normalize_whitespace=normalize_whitespace)
+        return {trglang: [result[k] for result in results] for k, trglang in enumerate(trglangs)}
+
+    async def _translate_sents_multi(self, texts, srclang, trglangs):
+        limits = self.batch_limits.per_target(len(trglangs))
+        join = lambda segments, results: tuple(join_segments(segments, translations)
+                                               for translations in zip(*results))
+        return await self._translate_batches(
+            texts, limits, lambda batch: self._translate_batch_multi(batch, srclang, trglangs),
+            lambda text: self.segment(text, srclang, limits.max_chars), join)
+
+
+class AsyncGoogleTranslator(_AsyncClient, GoogleTranslator):
+    """Asyncio counterpart of GoogleTranslator."""
+    def __init__(self, host, key, max_concurrency=10, session=None, **kwargs):
+        GoogleTranslator.__init__(self, host, key, **kwargs)
+        self._init_async(max_concurrency, session)
+        self._metadata_lock = asyncio.Lock()
+
+    async def languages(self):
+        async with self._metadata_lock:
+            if self._languages is None:
+                self._languages = set(await self._cached_json(self._fetch_languages))
+            return set(self._languages)
+
+    async def _fetch_languages(self):
+        response = await self.api_call('GET', 'languages')
+        if response.status_code != 200:
+            raise ResponseError(response.json())
+        return [l['language'] for l in response.json()['data']['languages']]
+
+    async def _detect(self, texts):
+        # See AsyncMicrosoftTranslator._detect()
+        return await self._translate_batches(
+            texts, self.batch_limits, self._detect_batch, _truncate(self.batch_limits), join=_first)
+
+    async def _detect_batch(self, batch):
+        response = await self.api_call('POST', 'detect', json={"q": batch},
+                                       chars=sum(map(len, batch)))
+        if response.status_code == 200:
+            return [d[0]['language'] for d in response.json()['data']['detections']]
+        else:
+            raise ResponseError(response.json())
+
+    async def _translate_batch(self, batch, srclang, trglang):
+        payload = {"q": batch, "target": trglang, "source": srclang, "format": "text"}
+        response = await self.api_call('POST', 'translate', json=payload,
+                                       chars=sum(map(len, batch)))
+        if response.status_code == 200:
+            return [t['translatedText'] for t in response.json()['data']['translations']]
+        else:
+            raise ResponseError(response.json())
+
+
+class AsyncSystranTranslator(_AsyncClient, SystranTranslator):
+    """Asyncio counterpart of SystranTranslator."""
+    def __init__(self, host, key, max_concurrency=10, session=None, **kwargs):
+        SystranTranslator.__init__(self, host, key, **kwargs)
+        self._init_async(max_concurrency, session)
+
+    async def api_call(self, http_method, method, text, lang=None, query=None, chars=None):
+        """Wrapper class over API calls."""
+        if query is None:
+            query = {"input":text,"lang":lang} if lang else {"input":text}
+        return await self._request(http_method, method, self.urls[method],
+                                   chars=len(text) if chars is None else chars, params=query)
+
+    async def _get_json(self, method, text, lang=None):
+        return (await self.api_call('GET', method, text, lang)).json()
+
+    async def lemmatize(self, text, lang):
+        output = await self._get_json('lemmatize', text, lang)
+        return [(tok['text'], tok['lemma']) for tok in output['lemmas']]
+
+    async def langid(self, text):
+        output = await self._get_json('langid', text)
+        return [(l['lang'], l['confidence']) for l in output['detectedLanguages']]
+
+    async def _detect(self, texts):
+        # One document per request, see SystranTranslator.detect_sents()
+        max_chars = self.batch_limits.max_segment_chars()
+        return [languages[0][0] for languages in
+                await asyncio.gather(*[self.langid(text[:max_chars]) for text in texts])]
+
+    async def ner(self, text, lang):
+        return await self._get_json('ner_annotate', text, lang)
+
+    async def pos(self, text, lang):
+        output = await self._get_json('pos', text, lang)
+        return [(token['text'], token['pos']) for token in output['partsOfSpeech']]
+
+    async def pos_tag(self, tokenized_text, lang):
+        output = await self._get_json('pos', ' '.join(tokenized_text), lang)
+        return [(token['text'], token['pos']) for token in output['partsOfSpeech']]
+
+    async def word_tokenize(self, text, lang):
+        output = await self._get_json('tokenize', text, lang)
+        return [token['source'] for sent in output['segments'] for token in sent['tokens']
+                if token['type'] != 'separator']
+
+    async def sent_tokenize(self, text, lang):
+        output = await self._get_json('tokenize', text, lang)
+        return [sent['source'] for sent in output['segments']]
+
+    async def doc_tokenize(self, text, lang):
+        output = await self._get_json('tokenize', text, lang)
+        return [[token['source'] for token in sent['tokens'] if token['type'] != 'separator']
+                for sent in output['segments']]
+
+    async def _translate(self, text, srclang, trglang):
+        query = {"source":srclang, "target":trglang,"input":text}
+        response = await self.api_call('GET', 'translate', text, query=query)
+        if response.status_code == 200:
+            output = response.json()['outputs'][0]
+            if 'error' in output:
+                raise ResponseError(output)
+            return output['output']
+        else:
+            raise ResponseError(response.json())
+
+    async def _translate_batch(self, batch, srclang, trglang):
+        # See SystranTranslator._translate_batch()
+        query = [("source", srclang), ("target", trglang)] + [("input", t) for t in batch]
+        response = await self.api_call('GET', 'translate', '', query=query,
+                                       chars=sum(map(len, batch)))
+        if response.status_code == 200:
+            outputs = response.json()['outputs']
+            translations = [o.get('output') if 'error' not in o else None for o in outputs]
+        elif len(batch) > 1 and is_input_error(response.status_code):
+            translations = [None] * len(batch)
+        else:
+            raise ResponseError(response.json())
+        return [await self._translate(text, srclang, trglang) if translation is None else translation
+                for text, translation in zip(batch, translations)]
+
+
+class AsyncGoogleASR(_AsyncClient, GoogleASR):
+    """Asyncio counterpart of GoogleASR."""
+    def __init__(self, host, key, max_concurrency=10, session=None, **kwargs):
+        GoogleASR.__init__(self, host, key, **kwargs)
+        self._init_async(max_concurrency, session)
+
+    async def transcribe(self, audio_file, lang, out_file=None):
+        return await self._recognize(self._config(lang), *self._whole_file(audio_file), out_file)
+
+    async def transcribe_many(self, files, lang):
+        """Transcribe several audio files concurrently, see GoogleASR.transcribe_many()."""
+        return list(await asyncio.gather(*[self.transcribe(audio_file, lang)
+                                           for audio_file in list_files(files)]))
+
+    async def transcribe_long(self, audio_file, lang, segment_seconds=55):
+        """Transcribe the `segment_seconds` segments of long audio
+        concurrently, see GoogleASR.transcribe_long()."""
+        config, segments = await asyncio.to_thread(self._segments, audio_file, lang,
+                                                   segment_seconds)
+        transcripts = await asyncio.gather(*[self._recognize(config, open_source, length)
+                                             for open_source, length in segments])
+        return " ".join(t for t in transcripts if t)
+
+    async def _recognize(self, config, open_source, length, out_file=None):
+        # Reading and encoding the audio is blocking file I/O. The body of one
+        # request, a minute of audio at most, is held in memory.
+        body = await asyncio.to_thread(lambda: self._body(config, open_source, length).read())
+        response = await self._request('POST', 'asr', self.urls['asr'], data=body)
+        return self._transcript(response, out_file)
@@ -0,0 +1,94 @@
+from aomame.cache import cached_translate, cached_translate_sents
+from aomame.metrics import NULL_METRICS
+from aomame.ratelimit import RateLimiter
+from aomame.utils import (make_session, translate_detected, translate_detected_multi,
+                          translate_per_target, translate_unique)
+
+
+class BaseTranslator:
+    """
+    Client setup and methods shared by the translators. Subclasses implement
+    _translate_sents(), translating a list of texts in batches, and
+    detect_sents(); translate() goes through _translate(), a single request
+    for a text that fits in one.
+    Args:
+        host: API host.
+        key: API key.
+        max_workers: Number of batch requests kept in flight by translate_sents().
+        session: requests.Session to use, by default one with a connection
+            pool of `pool_size` (at least `max_workers`) connections.
+        timeout: Seconds to wait for a response, None to wait forever.
+        keep_alive: If False, ask the server to close every connection.
+        requests_per_second, chars_per_minute, max_retries: Settings of the
+            aomame.ratelimit.RateLimiter created unless `rate_limiter` is given.
+        cache: Optional aomame.cache.TranslationCache consulted before dispatching.
+        metrics: Optional aomame.metrics.Metrics recording requests, retries and batches.
+    """
+    provider = None
+    batch_limits = None
+
+    def __init__(self, host, key, max_workers=1, session=None, pool_size=None,
+                 timeout=None, keep_alive=True,
+                 requests_per_second=None, chars_per_minute=None, max_retries=5,
+                 rate_limiter=None, cache=None, metrics=None):
+        self.host, self.key = host, key
+        self.max_workers = max_workers
+        self.session = session or make_session(pool_size or max(10, max_workers), keep_alive)
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or RateLimiter(requests_per_second,
+                                                        chars_per_minute, max_retries)
+        self.cache = cache
+        self.metrics = metrics or NULL_METRICS
+
+    def detect(self, text):
+        return self.detect_sents([text], quiet=True)[0]
+
+    def translate(self, text, srclang, trglang):
+        if srclang == 'auto':
+            return self.translate_sents([text], srclang, trglang, quiet=True)[0]
+        return cached_translate(self.cache, self.provider, text, srclang, trglang,
+                                lambda t: self._translate(t, srclang, trglang))
+
+    def _translate(self, text, srclang, trglang):
+        if self.batch_limits.fits_text(text):
+            return self._translate_batch([text], srclang, trglang)[0]
+        return self._translate_sents([text], srclang, trglang, quiet=True)[0]
+
+    def translate_sents(self, texts, srclang, trglang, quiet=False, max_workers=None,
+                        normalize_whitespace=False):
+        """Translate a list of texts, keeping up to `max_workers` batch
+        requests in flight at once. Repeated and cached texts are not sent,
+        the characters saved by deduplication are counted in `self.metrics`.
+        With srclang='auto' the texts are grouped by detected language, see
+        utils.translate_detected()."""
+        if srclang == 'auto':
+            return translate_detected(self, texts, trglang, quiet=quiet, max_workers=max_workers,
+                                      normalize_whitespace=normalize_whitespace)
+        translate = lambda uniques: cached_translate_sents(
+            self.cache, self.provider, uniques, srclang, trglang,
+            lambda misses: self._translate_sents(misses, srclang, trglang,
+                                                 quiet=quiet, max_workers=max_workers))
+        translations, chars_saved = translate_unique(
+            texts, translate, normalize_whitespace=normalize_whitespace)
+        self.metrics.deduplicated(self.provider, chars_saved)
+        return translations
+
+    def translate_sents_multi(self, texts, srclang, trglangs, quiet=False, max_workers=None,
+                              normalize_whitespace=False):
+        """Translate a list of texts into several target languages, one
+        concurrent translate_sents() per target, sharing `max_workers`
+        requests in flight between the targets. With srclang='auto' the
+        texts are grouped by detected language, see
+        utils.translate_detected_multi().
+        Returns:
+            A {trglang: translations} dict.
+        """
+        if srclang == 'auto':
+            return translate_detected_multi(self, texts, trglangs, quiet=quiet,
+                                            max_workers=max_workers,
+                                            normalize_whitespace=normalize_whitespace)
+        translate_sents = lambda texts, srclang, trglang, max_workers: self.translate_sents(
+            texts, srclang, trglang, quiet=quiet, max_workers=max_workers,
+            normalize_whitespace=normalize_whitespace)
+        return translate_per_target(translate_sents, texts, srclang, trglangs,
+                                    max_workers=max_workers or self.max_workers)
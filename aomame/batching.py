@@ -0,0 +1,170 @@
+import json
+import string
+
+from tqdm import tqdm
+
+from aomame.exceptions import ResponseError
+from aomame.segment import join_segments
+from aomame.utils import imap_ordered
+
+
+def json_size(text):
+    """Size in bytes of `text` as a JSON string, as sent by requests' json=."""
+    return len(json.dumps(text))
+
+
+# Bytes that urllib.parse.quote_plus() leaves as a single byte.
+_UNQUOTED = (string.ascii_letters + string.digits + '_.-~ ').encode('ascii')
+
+
+def query_size(text):
+    """Size in bytes of `text` as a URL-encoded query parameter value, every
+    other byte is percent-encoded into three."""
+    utf8 = text.encode('utf8')
+    return len(utf8) + 2 * len(utf8.translate(None, _UNQUOTED))
+
+
+class BatchLimits:
+    """
+    Per-request limits of a provider's batch endpoint.
+    Args:
+        max_items: Maximum number of texts per request.
+        max_chars: Maximum number of characters per request, None for no limit.
+        max_bytes: Maximum encoded payload size per request, None for no limit.
+        size: Function returning the encoded size of a text in the payload.
+        item_overhead: Encoded size of the payload around each text.
+    """
+    def __init__(self, max_items, max_chars=None, max_bytes=None, size=json_size, item_overhead=1):
+        self.max_items, self.max_chars, self.max_bytes = max_items, max_chars, max_bytes
+        self.size, self.item_overhead = size, item_overhead
+
+    def fits(self, items, chars, nbytes):
+        return (items <= self.max_items
+                and (self.max_chars is None or chars <= self.max_chars)
+                and (self.max_bytes is None or nbytes <= self.max_bytes))
+
+    def per_target(self, n):
+        """Limits for a request translated into `n` target languages, where
+        every character counts once per target."""
+        return BatchLimits(self.max_items, self.max_chars and self.max_chars // n, self.max_bytes,
+                           size=self.size, item_overhead=self.item_overhead)
+
+    def load(self, chars, nbytes):
+        """Largest fraction of the per-request character and byte limits taken
+        up by a text of `chars` characters and `nbytes` encoded bytes."""
+        return max(0 if self.max_chars is None else chars / self.max_chars,
+                   0 if self.max_bytes is None else nbytes / self.max_bytes)
+
+    def fits_text(self, text):
+        """Whether `text` fits in a request on its own."""
+        return self.fits(1, len(text), self.size(text) + self.item_overhead)
+
+    def max_segment_chars(self):
+        """Length of the segments an oversized text is split into, short
+        enough for any segment to fit in a request on its own."""
+        max_chars = self.max_chars
+        if self.max_bytes is not None:
+            # A character encodes into at most 12 bytes, as a JSON-escaped
+            # surrogate pair or a percent-encoded 4-byte UTF-8 sequence, plus
+            # the quotes of a JSON string.
+            by_bytes = (self.max_bytes - self.item_overhead - 2) // 12
+            max_chars = by_bytes if max_chars is None else min(max_chars, by_bytes)
+        return max_chars
+
+
+# See https://docs.microsoft.com/en-us/azure/cognitive-services/translator/request-limits
+MICROSOFT_LIMITS = BatchLimits(max_items=1000, max_chars=50000, item_overhead=len('{"Text": },'))
+# See https://docs.microsoft.com/en-us/azure/cognitive-services/translator/reference/v3-0-detect
+MICROSOFT_DETECT_LIMITS = BatchLimits(max_items=100, max_chars=50000, item_overhead=len('{"Text": },'))
+# See https://cloud.google.com/translate/quotas
+GOOGLE_LIMITS = BatchLimits(max_items=128, max_chars=30000, max_bytes=204800)
+# The inputs go in the query string, keep the URL well under common server limits.
+SYSTRAN_LIMITS = BatchLimits(max_items=50, max_bytes=6000, size=query_size,
+                             item_overhead=len('&input='))
+
+
+def plan_batches(texts, limits):
+    """
+    Pack texts into as few requests as `limits` allow, next-fit-decreasing:
+    the texts taking up the most of the binding limit (characters or encoded
+    bytes, see BatchLimits.load) are placed first, each into the current
+    batch while it has room. The texts only get smaller against that limit,
+    so a batch without room for the next one is topped up with the smallest
+    texts left and closed, which keeps planning linear in the number of
+    texts.
+    Returns:
+        The batches, as lists of indices into `texts` ordered by their first
+        index, and the indices of the texts too large for any batch.
+    """
+    sizes = [(len(t), limits.size(t) + limits.item_overhead) for t in texts]
+    oversized = [i for i, (chars, nbytes) in enumerate(sizes) if not limits.fits(1, chars, nbytes)]
+    loads = [limits.load(chars, nbytes) for chars, nbytes in sizes]
+    order = sorted(set(range(len(texts))).difference(oversized), key=loads.__getitem__,
+                   reverse=True)
+    batches, head, tail = [], 0, len(order) - 1
+    while head <= tail:
+        batch, chars, nbytes = [], 0, 0
+        for step in 1, -1:
+            while head <= tail:
+                i = order[head if step == 1 else tail]
+                if not limits.fits(len(batch) + 1, chars + sizes[i][0], nbytes + sizes[i][1]):
+                    break
+                batch.append(i)
+                chars, nbytes = chars + sizes[i][0], nbytes + sizes[i][1]
+                if step == 1:
+                    head += 1
+                else:
+                    tail -= 1
+        batches.append(sorted(batch))
+    batches.sort(key=lambda batch: batch[0])
+    return batches, oversized
+
+
+def check_batch(batch, results):
+    """Raise ResponseError unless a batch request returned one result per text."""
+    if len(results) != len(batch):
+        raise ResponseError(f"Expected {len(batch)} results for the batch, got {len(results)}")
+
+
+def translate_batches(texts, limits, translate_batch, translate_oversized=None,
+                      max_workers=1, quiet=False, split_oversized=None, join=join_segments):
+    """
+    Translate `texts` in the batches planned by plan_batches(), keeping up to
+    `max_workers` requests in flight, and restore the input order.
+    Args:
+        texts: List of texts.
+        limits: BatchLimits of the provider.
+        translate_batch: Callable translating a list of texts in one request.
+        translate_oversized: Callable translating a text too large for a
+            batch, only optional with `split_oversized`.
+        split_oversized: Optional callable splitting a text too large for a
+            batch into segments that fit in one. The segments are batched
+            alongside the other texts and their translations joined with
+            `join(segments, translations)`.
+    """
+    if split_oversized is not None:
+        segments, spans = [], []
+        for text in texts:
+            parts = [text] if limits.fits_text(text) else split_oversized(text)
+            spans.append((len(segments), len(segments) + len(parts)))
+            segments.extend(parts)
+        translations = translate_batches(segments, limits, translate_batch, translate_oversized,
+                                         max_workers=max_workers, quiet=quiet)
+        return [join(segments[start:end], translations[start:end])
+                for start, end in spans]
+
+    batches, oversized = plan_batches(texts, limits)
+    translations = [None] * len(texts)
+    send = lambda batch: translate_batch([texts[i] for i in batch])
+    with tqdm(total=len(texts), disable=quiet) as progress:
+        for batch, results in zip(batches, imap_ordered(send, batches, max_workers)):
+            check_batch(batch, results)
+            for i, translation in zip(batch, results):
+                translations[i] = translation
+            progress.update(len(batch))
+        for i in oversized:
+            if translate_oversized is None:
+                raise ResponseError(f"Text of {len(texts[i])} characters is too large for a request")
+            translations[i] = translate_oversized(texts[i])
+            progress.update(1)
+    return translations
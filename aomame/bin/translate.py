@@ -1,51 +1,423 @@
 from aomame import MicrosoftTranslator
 from aomame import SystranTranslator
 from aomame import GoogleTranslator
+from aomame import Metrics
+from aomame import RouterTranslator
+from aomame.utils import imap_ordered, prefetch
 
+import os
 import sys
+import mmap
+import atexit
+import json
+import shutil
+import time
 import argparse
+import traceback
+import multiprocessing
+import queue as queue_module
+from contextlib import ExitStack
+
 import tqdm
 
 def get_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("-api", required=True, choices=["google", "microsoft", "systran"])
-    parser.add_argument("-key", required=True, help="api key")
-    parser.add_argument("-i","--input-file", nargs='?', type=argparse.FileType('r'), default=sys.stdin, help="input file path or stdin input if empty")
-    parser.add_argument("-o","--output-file", nargs='?', type=argparse.FileType('w'), default=sys.stdout, help="output file path or stdout output if empty")
-    parser.add_argument("-slang", required=True, help="source language")
-    parser.add_argument("-tlang", required=True, help="target language")
+    parser.add_argument("-api", required=True, nargs='+', choices=["google", "microsoft", "systran"], help="api(s), several are routed between by latency and quota")
+    parser.add_argument("-key", required=True, nargs='+', help="api key, one per -api")
+    parser.add_argument("--host", default=None, nargs='+', help="api host, one per -api, e.g. a local mock server (default: the provider's public host)")
+    parser.add_argument("--scheme", default="https", choices=["https", "http"], help="url scheme of the api host")
+    parser.add_argument("-i","--input-file", nargs='?', default=None, help="input file path or stdin input if empty")
+    parser.add_argument("-o","--output-file", nargs='?', default=None, help="output file path or stdout output if empty, with several -tlang values OUTPUT_FILE.TLANG or a path containing {tlang}")
+    parser.add_argument("-slang", required=True, help="source language, or auto to detect the language of every line")
+    parser.add_argument("-tlang", required=True, nargs='+', help="target language(s), several are translated in one pass")
     parser.add_argument("-cs", "--cache-size", type=int, default=10000, help="number of lines to cache from file")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of batch requests kept in flight, per shard with --shards")
+    parser.add_argument("--shards", type=int, default=1, help="number of processes translating contiguous ranges of the input file, implies --stream")
+    parser.add_argument("--stream", action="store_true", help="pipeline reading, translation and writing with constant memory")
+    parser.add_argument("-bs", "--batch-size", type=int, default=100, help="number of lines per translation batch in --stream mode")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file recording finished input offsets, implies --stream (default: OUTPUT_FILE.ckpt with --resume)")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted run from its checkpoint, implies --stream")
+    parser.add_argument("--checkpoint-interval", type=float, default=10, help="seconds between checkpoints, each syncs the output files to disk")
+    parser.add_argument("--metrics", default=None, choices=["summary", "json", "prometheus"], help="print request metrics to stderr at exit")
+    parser.add_argument("--hedge-after", type=float, default=None, help="with several -api, seconds after which a slow batch is also sent to the next api")
+    parser.add_argument("--quota", nargs='+', default=[], metavar="API=CHARS", help="with several -api, number of characters an api may translate, an api given several times is numbered, e.g. google-2")
     args = parser.parse_args()
+    if args.resume or args.checkpoint:
+        if args.input_file in (None, '-') or args.output_file in (None, '-'):
+            parser.error("--resume and --checkpoint need -i and -o files")
+        args.stream = True
+    if len(args.tlang) > 1 and args.output_file in (None, '-'):
+        parser.error("several -tlang values need an -o file")
+    if args.shards > 1:
+        if args.input_file in (None, '-') or args.output_file in (None, '-'):
+            parser.error("--shards needs -i and -o files")
+        if args.resume or args.checkpoint:
+            parser.error("--shards can't be combined with --resume or --checkpoint")
+    if len(args.key) != len(args.api) or (args.host and len(args.host) != len(args.api)):
+        parser.error("-key and --host need one value per -api")
+    try:
+        args.quota = {api: int(chars) for api, chars in (q.split('=') for q in args.quota)}
+    except ValueError:
+        parser.error("--quota values must be API=CHARS")
     return args
 
 
-def translate_write(translator, cache,slang, tlang, out_file):
+def output_paths(output_file, tlangs):
+    """Return the output file path of every target language."""
+    if len(tlangs) == 1:
+        return [output_file]
+    if '{tlang}' in output_file:
+        return [output_file.format(tlang=tlang) for tlang in tlangs]
+    return [f"{output_file}.{tlang}" for tlang in tlangs]
+
+
+def translate_lines(translator, lines, slang, tlangs, quiet=False):
+    """Return the translations of `lines` into every language of `tlangs`."""
+    if len(tlangs) == 1:
+        return [translator.translate_sents(lines, slang, tlangs[0], quiet=quiet)]
+    translations = translator.translate_sents_multi(lines, slang, tlangs, quiet=quiet)
+    return [translations[tlang] for tlang in tlangs]
+
+
+def translate_write(translator, cache,slang, tlangs, out_files):
     #out_lines = "\n".join(["xx "+l for l in cache])
     #out_file.write("\n".join(cache) + "\n")
-    out_lines = "\n".join(translator.translate_sents(cache, slang, tlang))
-    out_file.write(out_lines + "\n")
+    for out_file, translations in zip(out_files, translate_lines(translator, cache, slang, tlangs)):
+        out_lines = "\n".join(translations)
+        out_file.write(out_lines + "\n")
+
+
+def read_batches(in_file, batch_size):
+    batch = []
+    for line in in_file:
+        batch.append(line.rstrip())
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_offset_batches(in_file, batch_size):
+    """Like read_batches() over a binary file, also yielding the byte offset
+    just past each batch."""
+    batch = []
+    for line in iter(in_file.readline, b''):
+        batch.append(line.decode('utf8').rstrip())
+        if len(batch) == batch_size:
+            yield batch, in_file.tell()
+            batch = []
+    if batch:
+        yield batch, in_file.tell()
+
+
+class Checkpoint:
+    """
+    Durable record of how far a job got: the byte offset of the first
+    untranslated input line and the matching length of every output file.
+    Saving syncs every output file to disk, so it is done at most every
+    `interval` seconds.
+    """
+    def __init__(self, path, interval=0):
+        self.path, self.interval = path, interval
+        self._saved_at = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as fin:
+            return json.load(fin)
+
+    def due(self):
+        """Whether `interval` seconds have passed since the last save."""
+        return self._saved_at is None or time.monotonic() - self._saved_at >= self.interval
+
+    def save(self, input_file, input_offset, out_files, output_offsets, lines):
+        # The output must be on disk before the checkpoint that points past it.
+        for out_file in out_files:
+            out_file.flush()
+            os.fsync(out_file.fileno())
+        state = {'input_file': os.path.abspath(input_file.name), 'input_offset': input_offset,
+                 'output_offsets': output_offsets, 'lines': lines}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fout:
+            json.dump(state, fout)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmp_path, self.path)
+        self._saved_at = time.monotonic()
+
+
+def stream_translate(translator, in_file, slang, tlangs, out_files, batch_size=100, workers=1,
+                     checkpoint=None, lines_done=0):
+    """
+    Translate `in_file` into `out_files`, one per language of `tlangs`, as a
+    pipeline: a reader thread feeds a
+    bounded queue of batches, up to `workers` batches are translated at once,
+    and translations are written in input order as soon as they are ready.
+    Memory use is bounded by the number of batches in flight.
+
+    With a `checkpoint`, both files must be opened in binary mode. The
+    checkpoint is saved after a batch is written once it is due, and when
+    the run ends or fails, so a crash loses at most its interval of work.
+    """
+    if checkpoint is None:
+        batches = ((batch, None) for batch in read_batches(in_file, batch_size))
+    else:
+        batches = read_offset_batches(in_file, batch_size)
+    batches = prefetch(batches, maxsize=workers)
+    translate = lambda item: (translate_lines(translator, item[0], slang, tlangs, quiet=True), item[1])
+    # Arguments of the checkpoint to save for the last batch written, if not saved yet.
+    unsaved = None
+    with tqdm.tqdm(unit=" lines", initial=lines_done) as progress:
+        try:
+            for translations, input_offset in imap_ordered(translate, batches, workers):
+                for out_file, target_translations in zip(out_files, translations):
+                    out_lines = "\n".join(target_translations) + "\n"
+                    if checkpoint is None:
+                        out_file.write(out_lines)
+                        out_file.flush()
+                    else:
+                        out_file.write(out_lines.encode('utf8'))
+                progress.update(len(translations[0]))
+                if checkpoint is not None:
+                    unsaved = (in_file, input_offset, out_files,
+                               [out_file.tell() for out_file in out_files], progress.n)
+                    if checkpoint.due():
+                        checkpoint.save(*unsaved)
+                        unsaved = None
+        finally:
+            if unsaved is not None:
+                checkpoint.save(*unsaved)
+
+
+def shard_offsets(mm, shards):
+    """
+    Sparse line index of `mm`: the byte offsets splitting it into `shards`
+    contiguous ranges of whole lines, found by searching for the newline
+    after each even split without reading the rest of the file.
+    """
+    size = len(mm)
+    offsets = [0]
+    for i in range(1, shards):
+        offset = max(offsets[-1], size * i // shards)
+        if offset and mm[offset - 1:offset] != b'\n':
+            newline = mm.find(b'\n', offset)
+            offset = size if newline < 0 else newline + 1
+        offsets.append(offset)
+    offsets.append(size)
+    return offsets
+
+
+def read_range_batches(mm, start, end, batch_size):
+    """Like read_offset_batches() over the lines of `mm[start:end]`."""
+    batch, offset = [], start
+    while offset < end:
+        newline = mm.find(b'\n', offset, end)
+        stop = end if newline < 0 else newline + 1
+        batch.append(mm[offset:stop].decode('utf8').rstrip())
+        offset = stop
+        if len(batch) == batch_size:
+            yield batch, offset
+            batch = []
+    if batch:
+        yield batch, offset
+
+
+def translate_shard(args, shard, start, end, part_paths, queue):
+    """Worker process of shard_translate(), translating the input lines in
+    [`start`, `end`) into `part_paths` with its own client."""
+    try:
+        metrics = Metrics() if args.metrics else None
+        translator = build_translator(args, 1, max(10, args.workers), metrics)
+        with ExitStack() as stack:
+            in_file = stack.enter_context(open(args.input_file, 'rb'))
+            mm = stack.enter_context(mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ))
+            out_files = [stack.enter_context(open(path, 'wb')) for path in part_paths]
+            batches = prefetch(read_range_batches(mm, start, end, args.batch_size), maxsize=args.workers)
+            translate = lambda item: (translate_lines(translator, item[0], args.slang, args.tlang, quiet=True), item[1])
+            done = start
+            for translations, offset in imap_ordered(translate, batches, args.workers):
+                for out_file, target_translations in zip(out_files, translations):
+                    out_file.write(("\n".join(target_translations) + "\n").encode('utf8'))
+                queue.put(('progress', shard, offset - done))
+                done = offset
+        queue.put(('done', shard, metrics.snapshot() if metrics else None))
+    except BaseException:
+        queue.put(('error', shard, traceback.format_exc()))
+
+
+def shard_translate(args, metrics=None, poll_interval=1.0):
+    """
+    Translate the input file with `args.shards` processes, each streaming a
+    contiguous range of lines into its own part files, then stitch the parts
+    into the outputs in order. Progress is reported in input bytes. If a
+    process fails, or dies without reporting (checked after every
+    `poll_interval` seconds without news), the others are stopped, the part
+    files removed and the job exits.
+    """
+    with open(args.input_file, 'rb') as in_file:
+        size = os.fstat(in_file.fileno()).st_size
+        if size:
+            with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offsets = shard_offsets(mm, args.shards)
+        else:
+            offsets = [0]
+    ranges = [(start, end) for start, end in zip(offsets, offsets[1:]) if start < end]
+    paths = output_paths(args.output_file, args.tlang)
+    part_paths = [[f"{path}.part{shard}" for path in paths] for shard in range(len(ranges))]
+
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=translate_shard,
+                                         args=(args, shard, start, end, part_paths[shard], queue))
+                 for shard, (start, end) in enumerate(ranges)]
+    for process in processes:
+        process.start()
+    running, failure = set(range(len(processes))), None
+    try:
+        with tqdm.tqdm(total=size, unit="B", unit_scale=True) as progress:
+            while running and failure is None:
+                try:
+                    kind, shard, payload = queue.get(timeout=poll_interval)
+                except queue_module.Empty:
+                    # A worker killed by a signal or the OOM killer never
+                    # reports, so look for workers that exited without doing so.
+                    for shard in sorted(running):
+                        if processes[shard].exitcode is not None:
+                            failure = f"Shard {shard} exited with code {processes[shard].exitcode}"
+                            break
+                    continue
+                if kind == 'progress':
+                    progress.update(payload)
+                elif kind == 'done':
+                    running.discard(shard)
+                    if metrics and payload:
+                        metrics.merge(payload)
+                else:
+                    failure = f"Shard {shard} failed:\n{payload}"
+    finally:
+        for process in processes:
+            if process.is_alive() and running:
+                process.terminate()
+            process.join()
+        if running:
+            for path in (path for shard_paths in part_paths for path in shard_paths):
+                if os.path.exists(path):
+                    os.remove(path)
+    if failure is not None:
+        sys.exit(failure)
+
+    for k, path in enumerate(paths):
+        with open(path, 'wb') as fout:
+            for shard_paths in part_paths:
+                with open(shard_paths[k], 'rb') as fin:
+                    shutil.copyfileobj(fin, fout, 1 << 20)
+                os.remove(shard_paths[k])
+
+
+def resume_translate(translator, args):
+    """Run stream_translate() with a checkpoint, continuing from the last
+    finished batch when resuming."""
+    checkpoint = Checkpoint(args.checkpoint or args.output_file + '.ckpt',
+                            interval=args.checkpoint_interval)
+    state = checkpoint.load() if args.resume else None
+    if state and state['input_file'] != os.path.abspath(args.input_file):
+        sys.exit(f"Checkpoint {checkpoint.path} was written for {state['input_file']}")
+    with ExitStack() as stack:
+        in_file = stack.enter_context(open(args.input_file, 'rb'))
+        out_files = [stack.enter_context(open(path, 'r+b' if state else 'wb'))
+                     for path in output_paths(args.output_file, args.tlang)]
+        if state:
+            # Drop any output written after the last checkpoint and carry on
+            # from the first unfinished input line.
+            in_file.seek(state['input_offset'])
+            for out_file, output_offset in zip(out_files, state['output_offsets']):
+                out_file.truncate(output_offset)
+                out_file.seek(output_offset)
+        stream_translate(translator, in_file, args.slang, args.tlang, out_files,
+                         batch_size=args.batch_size, workers=args.workers,
+                         checkpoint=checkpoint, lines_done=state['lines'] if state else 0)
+
+
+def make_translator(api, key, host, scheme, max_workers, pool_size, metrics):
+    if api == "google":
+        translator = GoogleTranslator(host or "translation.googleapis.com", key,
+                                      max_workers=max_workers, pool_size=pool_size,
+                                      scheme=scheme, metrics=metrics)
+    elif api == "microsoft":
+        translator = MicrosoftTranslator(host or 'api.cognitive.microsofttranslator.com', key,
+                                         max_workers=max_workers, pool_size=pool_size,
+                                         scheme=scheme, metrics=metrics)
+    elif api == "systran":
+        translator = SystranTranslator(host or "systran-systran-platform-for-language-processing-v1.p.rapidapi.com", key,
+                                       max_workers=max_workers, pool_size=pool_size,
+                                       scheme=scheme, metrics=metrics)
+    else:
+        raise NotImplementedError
+    return translator
+
+
+def build_translator(args, max_workers, pool_size, metrics):
+    """The translator of the -api values, routed between if there are several."""
+    hosts = args.host or [None] * len(args.api)
+    translators = [make_translator(api, key, host, args.scheme, max_workers, pool_size, metrics)
+                   for api, key, host in zip(args.api, args.key, hosts)]
+    if len(translators) == 1:
+        return translators[0]
+    return RouterTranslator(translators, quotas=args.quota, max_workers=max_workers,
+                            hedge_after=args.hedge_after, metrics=metrics)
+
+
+def print_metrics(metrics, format):
+    if format == "json":
+        print(metrics.to_json(), file=sys.stderr)
+    elif format == "prometheus":
+        print(metrics.to_prometheus(), end="", file=sys.stderr)
+    else:
+        print(metrics.summary(), file=sys.stderr)
+
 
 def main():
     # get command line arguments
     args = get_args()
 
     # set API
-    if args.api == "google":
-        translator = GoogleTranslator("translation.googleapis.com", args.key)
-    elif args.api == "microsoft":
-        translator = MicrosoftTranslator('api.cognitive.microsofttranslator.com', args.key)
-    elif args.api == "systran":
-        translator = SystranTranslator("systran-systran-platform-for-language-processing-v1.p.rapidapi.com", args,key)
+    # In --stream mode the workers are spread over batches by stream_translate().
+    max_workers = 1 if args.stream else args.workers
+    pool_size = max(10, args.workers)
+    metrics = Metrics() if args.metrics else None
+    if metrics:
+        atexit.register(print_metrics, metrics, args.metrics)
+    if args.shards > 1:
+        shard_translate(args, metrics)
+        return
+    translator = build_translator(args, max_workers, pool_size, metrics)
+
+    if args.resume or args.checkpoint:
+        resume_translate(translator, args)
+        return
+
+    input_file = open(args.input_file) if args.input_file not in (None, '-') else sys.stdin
+    if args.output_file not in (None, '-'):
+        output_files = [open(path, 'w') for path in output_paths(args.output_file, args.tlang)]
     else:
-        raise NotImplementedError
-    
+        output_files = [sys.stdout]
+    if args.stream:
+        stream_translate(translator, input_file, args.slang, args.tlang, output_files,
+                         batch_size=args.batch_size, workers=args.workers)
+        return
+
     # translate and write/print outputs
     cache = []
-    for line in tqdm.tqdm(args.input_file):
+    for line in tqdm.tqdm(input_file):
         if len(cache) < args.cache_size:
             cache.append(line.rstrip())
         else:
-            translate_write(translator, cache, args.slang, args.tlang, args.output_file)
+            translate_write(translator, cache, args.slang, args.tlang, output_files)
             cache = [line.rstrip()]
             #"\n".join(translator.translate_sents)
-    translate_write(translator, cache, args.slang, args.tlang, args.output_file)
+    translate_write(translator, cache, args.slang, args.tlang, output_files)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TranslationCache:
+    """
+    Translation memory keyed on (provider, srclang, trglang, text).
+
+    Lookups go to an in-process LRU tier first and then, if `path` is given,
+    to an on-disk SQLite tier that persists across runs and processes.
+    Args:
+        maxsize: Maximum number of entries kept in memory.
+        path: SQLite database file for the on-disk tier, None to disable it.
+        ttl: Seconds after which an entry expires, None to never expire.
+        max_disk_entries: Maximum number of rows kept on disk, None for no
+            limit. Once over it, the oldest rows are dropped down to 90% of
+            it at once.
+    """
+    def __init__(self, maxsize=100000, path=None, ttl=None, max_disk_entries=None):
+        self.maxsize, self.path = maxsize, path
+        self.ttl, self.max_disk_entries = ttl, max_disk_entries
+        self.hits, self.misses = 0, 0
+        self._memory = OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+        # Estimated number of rows on disk, counted exactly only when the
+        # estimate goes over max_disk_entries. Rows replaced by set_many()
+        # and other processes' writes make it approximate.
+        self._disk_entries = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS tm ("
+                             "provider TEXT, srclang TEXT, trglang TEXT, text TEXT, "
+                             "translation TEXT, created REAL, "
+                             "PRIMARY KEY (provider, srclang, trglang, text))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS tm_created ON tm (created)")
+            self._db.commit()
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key, translation, created):
+        self._memory[key] = (translation, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def get_many(self, provider, srclang, trglang, texts):
+        """Return a {text: translation} dict of the texts found in the cache."""
+        now = time.time()
+        found, missing = {}, []
+        with self._lock:
+            for text in dict.fromkeys(texts):
+                key = (provider, srclang, trglang, text)
+                entry = self._memory.get(key)
+                if entry is not None and self._expired(entry[1], now):
+                    del self._memory[key]
+                    entry = None
+                if entry is None:
+                    missing.append(text)
+                else:
+                    self._memory.move_to_end(key)
+                    found[text] = entry[0]
+
+            if self._db is not None and missing:
+                oldest = now - self.ttl if self.ttl is not None else float('-inf')
+                # Stay well under SQLite's limit on bound parameters.
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i+500]
+                    rows = self._db.execute(
+                        "SELECT text, translation, created FROM tm "
+                        "WHERE provider=? AND srclang=? AND trglang=? AND created>=? "
+                        f"AND text IN ({','.join('?' * len(chunk))})",
+                        (provider, srclang, trglang, oldest, *chunk))
+                    for text, translation, created in rows:
+                        self._remember((provider, srclang, trglang, text), translation, created)
+                        found[text] = translation
+
+            hits = sum(1 for text in texts if text in found)
+            self.hits += hits
+            self.misses += len(texts) - hits
+        return found
+
+    def get(self, provider, srclang, trglang, text):
+        """Return the cached translation of `text`, or None."""
+        return self.get_many(provider, srclang, trglang, [text]).get(text)
+
+    def set_many(self, provider, srclang, trglang, texts, translations):
+        """Store the translations of `texts` in both tiers."""
+        now = time.time()
+        with self._lock:
+            for text, translation in zip(texts, translations):
+                self._remember((provider, srclang, trglang, text), translation, now)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO tm VALUES (?, ?, ?, ?, ?, ?)",
+                    [(provider, srclang, trglang, text, translation, now)
+                     for text, translation in zip(texts, translations)])
+                self._evict(now, len(texts))
+                self._db.commit()
+
+    def set(self, provider, srclang, trglang, text, translation):
+        self.set_many(provider, srclang, trglang, [text], [translation])
+
+    def _evict(self, now, added):
+        expired = 0
+        if self.ttl is not None:
+            expired = self._db.execute("DELETE FROM tm WHERE created<?", (now - self.ttl,)).rowcount
+        if self.max_disk_entries is None:
+            return
+        if self._disk_entries is not None:
+            self._disk_entries += added - expired
+        if self._disk_entries is None or self._disk_entries > self.max_disk_entries:
+            self._disk_entries = self._db.execute("SELECT COUNT(*) FROM tm").fetchone()[0]
+            if self._disk_entries > self.max_disk_entries:
+                # Drop the oldest rows in bulk, so that the next writes have
+                # room without evicting again.
+                excess = self._disk_entries - self.max_disk_entries * 9 // 10
+                self._db.execute("DELETE FROM tm WHERE rowid IN (SELECT rowid FROM tm "
+                                 "ORDER BY created LIMIT ?)", (excess,))
+                self._disk_entries -= excess
+
+    def stats(self):
+        """Return the hit/miss counters and the size of the in-memory tier."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / total if total else 0.0,
+                    'memory_entries': len(self._memory)}
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM tm")
+                self._db.commit()
+                self._disk_entries = 0
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def cached_translate_sents(cache, provider, texts, srclang, trglang, translate):
+    """
+    Translate `texts` with `translate(misses)`, sending only the texts that
+    are not in `cache` and storing the new translations in it.
+    """
+    if cache is None:
+        return translate(texts)
+    found = cache.get_many(provider, srclang, trglang, texts)
+    misses = [t for t in texts if t not in found]
+    if misses:
+        translations = translate(misses)
+        cache.set_many(provider, srclang, trglang, misses, translations)
+        found.update(zip(misses, translations))
+    return [found[t] for t in texts]
+
+
+def cached_translate(cache, provider, text, srclang, trglang, translate):
+    """Translate a single `text` with `translate(text)` unless it is cached."""
+    if cache is None:
+        return translate(text)
+    translation = cache.get(provider, srclang, trglang, text)
+    if translation is None:
+        translation = translate(text)
+        cache.set(provider, srclang, trglang, text, translation)
+    return translation
+
+
+def cached_translate_sents_multi(cache, provider, texts, srclang, trglangs, translate):
+    """
+    Like cached_translate_sents() for several target languages at once,
+    `translate(misses)` returns a tuple of translations per text, one per
+    target. Texts missing from the cache for any target are sent.
+    """
+    if cache is None:
+        return translate(texts)
+    found = {trglang: cache.get_many(provider, srclang, trglang, texts) for trglang in trglangs}
+    misses = [t for t in texts if any(t not in found[trglang] for trglang in trglangs)]
+    if misses:
+        results = translate(misses)
+        for k, trglang in enumerate(trglangs):
+            translations = [result[k] for result in results]
+            cache.set_many(provider, srclang, trglang, misses, translations)
+            found[trglang].update(zip(misses, translations))
+    return [tuple(found[trglang][t] for trglang in trglangs) for t in texts]
+
+
+def cached_detect_sents(cache, provider, texts, detect):
+    """
+    Detect the language of `texts` with `detect(misses)`, sending only the
+    texts whose language is not in `cache`. Detections are kept apart from
+    translations under the provider name `{provider}:detect`.
+    """
+    return cached_translate_sents(cache, f'{provider}:detect', texts, '', '', detect)
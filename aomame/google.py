@@ -1,15 +1,31 @@
+import os
+import threading
 
-import requests
-from tqdm import tqdm
-
+from aomame.base import BaseTranslator
+from aomame.batching import GOOGLE_LIMITS, translate_batches
+from aomame.cache import cached_detect_sents
 from aomame.exceptions import ResponseError
+from aomame.metrics import instrumented_call
+from aomame.segment import segment_text
+from aomame.utils import METADATA_DIR, cached_json, translate_unique
+
+class GoogleTranslator(BaseTranslator):
+    provider = 'google'
+    batch_limits = GOOGLE_LIMITS
 
-class GoogleTranslator:
-    def __init__(self, host, key):
+    def __init__(self, host, key, max_workers=1, session=None, pool_size=None,
+                 timeout=None, keep_alive=True,
+                 requests_per_second=None, chars_per_minute=None, max_retries=5,
+                 rate_limiter=None, cache=None, metadata_dir=METADATA_DIR, metadata_ttl=86400,
+                 scheme='https', metrics=None):
         """Python SDK for
         https://cloud.google.com/translate/docs/apis"""
         # Default host: "translation.googleapis.com"
-        self.host, self.key = host, key
+        super().__init__(host, key, max_workers=max_workers, session=session,
+                         pool_size=pool_size, timeout=timeout, keep_alive=keep_alive,
+                         requests_per_second=requests_per_second,
+                         chars_per_minute=chars_per_minute, max_retries=max_retries,
+                         rate_limiter=rate_limiter, cache=cache, metrics=metrics)
         self.headers = {"Content-Type": "application/json; charset=utf-8"}
 
         self.endpoints = {'translate': f"language/translate/v2?key={self.key}",
@@ -17,60 +33,82 @@ class GoogleTranslator:
                           'detect': f"language/translate/v2/detect?key={self.key}",
                           }
 
-        self.urls = {k:"https://" + self.host + '/' + v for k,v in self.endpoints.items()}
+        self.urls = {k:scheme + "://" + self.host + '/' + v for k,v in self.endpoints.items()}
+
+        # The list of languages is fetched lazily, once, and kept in
+        # `metadata_dir` for `metadata_ttl` seconds. Set `metadata_dir` to
+        # None to skip the disk.
+        self.metadata_dir, self.metadata_ttl = metadata_dir, metadata_ttl
+        self._languages = None
+        self._metadata_lock = threading.Lock()
 
-    def api_call(self, operation, method, params=None, json=None):
+    def api_call(self, operation, method, params=None, json=None, chars=0):
         """Wrapper class over API calls."""
         # Add other parameters.
         url = self.urls[method] + params if params else self.urls[method]
-        response = operation(url, headers=self.headers, json=json)
-        return response
+        send = lambda: operation(url, headers=self.headers, json=json, timeout=self.timeout)
+        return instrumented_call(self.metrics, self.rate_limiter, self.provider, method,
+                                 send, chars=chars)
+
+    def _metadata_path(self):
+        if self.metadata_dir:
+            return os.path.join(self.metadata_dir, f'{self.provider}-{self.host}-languages.json')
+
+    def _fetch_languages(self):
+        response = self.api_call(self.session.get, 'languages')
+        if response.status_code == 200:
+            return [l['language'] for l in response.json()['data']['languages']]
+        else:
+            raise ResponseError(response.json())
 
     def languages(self):
-        response = self.api_call(requests.get, 'languages')
-        return set(l['language'] for l in response.json()['data']['languages'])
+        with self._metadata_lock:
+            if self._languages is None:
+                self._languages = set(cached_json(self._metadata_path(), self.metadata_ttl,
+                                                  self._fetch_languages))
+            return set(self._languages)
 
-    def detect(self, text):
-        payload = {"q": [text]}
-        response = self.api_call(requests.post, 'detect', json=payload)
-        return response.json()['data']['detections'][0][0]['language']
+    def _detect_batch(self, batch):
+        with self.metrics.batch(self.provider, batch, self.batch_limits):
+            response = self.api_call(self.session.post, 'detect', json={"q": batch},
+                                     chars=sum(map(len, batch)))
+        if response.status_code == 200:
+            return [d[0]['language'] for d in response.json()['data']['detections']]
+        else:
+            raise ResponseError(response.json())
 
-    def translate(self, text, srclang, trglang):
-        payload = {"q": [text], "target": trglang, "source": srclang, "format": "text"}
-        response = self.api_call(requests.post, 'translate', json=payload)
-        translation = response.json()['data']['translations'][0]['translatedText']
-        return translation
+    def detect_sents(self, texts, quiet=False, max_workers=None):
+        """Detect the language of a list of texts, sent as `q` arrays in
+        batches under the translation limits. Repeated and cached texts are
+        not sent."""
+        # The start of a text too long for a request is enough to detect it.
+        detect = lambda uniques: cached_detect_sents(
+            self.cache, self.provider, uniques,
+            lambda misses: translate_batches(
+                misses, self.batch_limits, self._detect_batch,
+                lambda text: self._detect_batch([text[:self.batch_limits.max_segment_chars()]])[0],
+                max_workers=max_workers or self.max_workers, quiet=quiet))
+        languages, _ = translate_unique(texts, detect)
+        return languages
 
-    def _get_multiple_translations(self, texts, srclang, trglang):
-        # Splitting texts into batches.
-        # See https://cloud.google.com/translate/quotas
-        responses = []
-        batch = []
-        len_batch = 0
-        for t in tqdm(texts):
-            if len_batch + len(t) < 5000 and len(batch) < 100:
-                batch.append(t)
-                len_batch += len(t)
-            else:
-                # Process this batch.
-                payload = {"q": batch, "target": trglang, "source": srclang, "format": "text"}
-                yield self.api_call(requests.post, 'translate', json=payload)
-                # Clear this batch, prepare the next batch.
-                batch = [t]
-                len_batch = len(t)
-        # Process last batch.
-        if batch:
-            payload = {"q": batch, "target": trglang, "source": srclang, "format": "text"}
-            yield self.api_call(requests.post, 'translate', json=payload)
+    def _translate_batch(self, batch, srclang, trglang):
+        payload = {"q": batch, "target": trglang, "source": srclang, "format": "text"}
+        with self.metrics.batch(self.provider, batch, self.batch_limits):
+            response = self.api_call(self.session.post, 'translate', json=payload,
+                                     chars=sum(map(len, batch)))
+        if response.status_code == 200:
+            return [t['translatedText'] for t in response.json()['data']['translations']]
+        else:
+            raise ResponseError(response.json())
 
-    def translate_sents(self, texts, srclang, trglang):
-        translations = []
-        for response in self._get_multiple_translations(texts, srclang, trglang):
-            if response.status_code == 200:
-                for t in response.json()['data']['translations']:
-                    translations.append(t['translatedText'])
-            else:
-                raise ResponseError(response.json())
+    def _translate_sents(self, texts, srclang, trglang, quiet=False, max_workers=None):
+        # Texts too long for a request are split into sentences that are
+        # batched with the other texts.
+        translations = translate_batches(
+            texts, self.batch_limits,
+            lambda batch: self._translate_batch(batch, srclang, trglang),
+            max_workers=max_workers or self.max_workers, quiet=quiet,
+            split_oversized=lambda text: segment_text(text, self.batch_limits.max_segment_chars()))
         # Sanity check to check that all sentences are translated.
         assert len(texts) == len(translations)
         return translations
@@ -1,30 +1,139 @@
 
-import requests
 from tqdm import tqdm
 import base64
 import json
+import os
+import wave
 
 from aomame.exceptions import ResponseError
+from aomame.metrics import NULL_METRICS, instrumented_call
+from aomame.ratelimit import RateLimiter
+from aomame.utils import imap_ordered, make_session
+
+# Raw bytes encoded per read, a multiple of 3 so that the base64 of the
+# chunks concatenates into the base64 of the whole, and of the frame size
+# of 8, 16 and 32-bit mono or stereo audio.
+CHUNK_SIZE = 3 * 2 ** 14
+
+
+class Base64Body:
+    """
+    File-like request body that base64-encodes `length` bytes of `source`
+    between the bytes `prefix` and `suffix` as it is read, so the audio is
+    never held in memory as a whole. `requests` sends it in blocks and takes
+    the Content-Length from len().
+    """
+    def __init__(self, prefix, source, length, suffix, chunk_size=CHUNK_SIZE):
+        self.source, self.chunk_size = source, chunk_size
+        self._length = len(prefix) + 4 * ((length + 2) // 3) + len(suffix)
+        self._chunks = self._encode(prefix, suffix)
+        self._buffer = b''
+
+    def _encode(self, prefix, suffix):
+        yield prefix
+        leftover = b''
+        while True:
+            chunk = self.source.read(self.chunk_size)
+            if not chunk:
+                break
+            chunk = leftover + chunk
+            cut = len(chunk) - len(chunk) % 3
+            leftover = chunk[cut:]
+            yield base64.b64encode(chunk[:cut])
+        yield base64.b64encode(leftover) + suffix
+        self.source.close()
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class _WaveFrames:
+    """read() over `nframes` frames of a WAV file from frame `start`."""
+    def __init__(self, audio_file, start, nframes):
+        self._wav = wave.open(audio_file, 'rb')
+        self._wav.setpos(start)
+        self._framesize = self._wav.getsampwidth() * self._wav.getnchannels()
+        self._left = nframes
+
+    def read(self, size):
+        nframes = min(self._left, max(1, size // self._framesize))
+        self._left -= nframes
+        return self._wav.readframes(nframes) if nframes else b''
+
+    def close(self):
+        self._wav.close()
+
+
+class _FileRange:
+    """read() over `length` bytes of a file from byte `start`."""
+    def __init__(self, audio_file, start, length):
+        self._file = open(audio_file, 'rb')
+        self._file.seek(start)
+        self._left = length
+
+    def read(self, size):
+        data = self._file.read(min(self._left, size))
+        self._left -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def list_files(files):
+    """`files`, or the files in it, sorted, if it is a directory."""
+    if isinstance(files, str) and os.path.isdir(files):
+        return sorted(os.path.join(files, name) for name in os.listdir(files)
+                      if os.path.isfile(os.path.join(files, name)))
+    return files
+
 
 class GoogleASR:
-    def __init__(self, host, key):
+    provider = 'google_asr'
+
+    def __init__(self, host, key, session=None, pool_size=None,
+                 timeout=None, keep_alive=True,
+                 requests_per_second=None, chars_per_minute=None, max_retries=5,
+                 rate_limiter=None, scheme='https', metrics=None):
         """Python SDK for
         https://cloud.google.com/speech-to-text/docs/apis"""
         # Default host: "speech.googleapis.com"
         self.host, self.key = host, key
+        # Connection-pooled session reused by every call, unless one is injected.
+        self.session = session or make_session(pool_size or 10, keep_alive)
+        self.timeout = timeout
+        # Request scheduler shared by every call, unless one is injected.
+        self.rate_limiter = rate_limiter or RateLimiter(requests_per_second,
+                                                        chars_per_minute, max_retries)
+        self.metrics = metrics or NULL_METRICS
         self.headers = {"Content-Type": "application/json; charset=utf-8"}
 
         self.endpoints = {'asr': f"v1/speech:recognize?key={self.key}",
                           }
-        self.urls = {k:"https://" + self.host + '/' + v for k,v in self.endpoints.items()}
+        self.urls = {k:scheme + "://" + self.host + '/' + v for k,v in self.endpoints.items()}
 
 
-    def api_call(self, operation, method, params=None, json=None):
-        """Wrapper class over API calls."""
+    def api_call(self, operation, method, params=None, json=None, data=None, chars=0):
+        """Wrapper class over API calls.
+        `data` is a callable returning the request body, called for every
+        attempt so that a retry sends a streamed body from its start."""
         # Add other parameters.
         url = self.urls[method] + params if params else self.urls[method]
-        response = operation(url, headers=self.headers, json=json)
-        return response
+        send = lambda: operation(url, headers=self.headers, json=json,
+                                 data=data() if data else None, timeout=self.timeout)
+        return instrumented_call(self.metrics, self.rate_limiter, self.provider, method,
+                                 send, chars=chars)
     
     def _encode_audio(self, audio_file):
         """ Enocde audio file as Base64 string """
@@ -35,21 +144,90 @@ class GoogleASR:
 
     def _create_request(self, audio_file, lang):
         payload = {
-          'config': {
-            'encoding': 'LINEAR16',
-            'sampleRateHertz': 16000,
-            'languageCode': '{}'.format(lang),
-            'enableAutomaticPunctuation': 'true'
-          },
+          'config': self._config(lang),
           'audio': {
             'content': self._encode_audio(audio_file)
           }
         }
         return payload
     
+    def _config(self, lang, sample_rate=16000, channels=None):
+        config = {
+            'encoding': 'LINEAR16',
+            'sampleRateHertz': sample_rate,
+            'languageCode': '{}'.format(lang),
+            'enableAutomaticPunctuation': 'true'
+        }
+        # Only set for headerless segments, Google rejects a count that
+        # doesn't match the header of a WAV file.
+        if channels is not None:
+            config['audioChannelCount'] = channels
+        return config
+
+    def _body(self, config, open_source, length):
+        # The request JSON with the base64 audio streamed in as the content.
+        prefix = (json.dumps({'config': config})[:-1] + ', "audio": {"content": "').encode('utf8')
+        return Base64Body(prefix, open_source(), length, b'"}}')
+
+    def _recognize(self, config, open_source, length, out_file=None):
+        body = lambda: self._body(config, open_source, length)
+        response = self.api_call(self.session.post, 'asr', data=body)
+        return self._transcript(response, out_file)
+
     def transcribe(self, audio_file, lang, out_file=None):
-        payload = self._create_request(audio_file, lang)
-        response = self.api_call(requests.post, 'asr', json=payload)
+        return self._recognize(self._config(lang), *self._whole_file(audio_file), out_file)
+
+    def _whole_file(self, audio_file):
+        length = os.path.getsize(audio_file)
+        return lambda: _FileRange(audio_file, 0, length), length
+
+    def transcribe_many(self, files, lang, workers=1, quiet=False):
+        """
+        Transcribe several audio files with up to `workers` requests in flight.
+        Args:
+            files: List of audio file paths, or a directory of them.
+        Returns:
+            The transcripts, in the order of `files`.
+        """
+        files = list_files(files)
+        transcribe = lambda audio_file: self.transcribe(audio_file, lang)
+        return list(tqdm(imap_ordered(transcribe, files, workers),
+                         total=len(files), disable=quiet))
+
+    def transcribe_long(self, audio_file, lang, segment_seconds=55, workers=1, quiet=False):
+        """
+        Transcribe audio longer than a recognize request allows by splitting it
+        into `segment_seconds` segments transcribed in parallel.
+        WAV files are split on frames with their own sample rate and channels,
+        other files are read as headerless 16kHz mono LINEAR16.
+        """
+        config, segments = self._segments(audio_file, lang, segment_seconds)
+        transcribe = lambda segment: self._recognize(config, *segment)
+        transcripts = tqdm(imap_ordered(transcribe, segments, workers),
+                           total=len(segments), disable=quiet)
+        return " ".join(t for t in transcripts if t)
+
+    def _segments(self, audio_file, lang, segment_seconds):
+        """The recognize config of `audio_file` and its `segment_seconds`
+        segments, as (open_source, length) arguments of _recognize()."""
+        try:
+            with wave.open(audio_file, 'rb') as wav:
+                if wav.getsampwidth() != 2:
+                    raise ValueError(f"{audio_file} is not 16-bit LINEAR16 audio")
+                sample_rate, channels = wav.getframerate(), wav.getnchannels()
+                nframes, framesize = wav.getnframes(), 2 * channels
+            source = lambda start, n: _WaveFrames(audio_file, start, n)
+        except wave.Error:
+            sample_rate, channels, framesize = 16000, 1, 2
+            nframes = os.path.getsize(audio_file) // framesize
+            source = lambda start, n: _FileRange(audio_file, start * framesize, n * framesize)
+
+        step = segment_seconds * sample_rate
+        segments = [(start, min(step, nframes - start)) for start in range(0, nframes, step)]
+        return self._config(lang, sample_rate, channels), [
+            (lambda start=start, n=n: source(start, n), n * framesize) for start, n in segments]
+
+    def _transcript(self, response, out_file=None):
         result = response.json()
 
         if out_file:
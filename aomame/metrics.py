@@ -0,0 +1,271 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds.
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum, self.count = 0.0, 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the `q` quantile, inf past the last bucket."""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return 0.0
+
+
+def _labels(labels):
+    return ','.join(f'{k}="{v}"' for k, v in labels)
+
+
+class Metrics:
+    """
+    Counters, histograms and event callbacks for the clients' hot path.
+
+    Pass an instance as the `metrics` argument of a client, or of several
+    clients to aggregate them. Every callback is called as
+    `callback(event, fields)` with the event name ('request', 'retry',
+    'batch', 'span' or 'deduplicated') and a dict of its fields, on the
+    thread of the call.
+    """
+    enabled = True
+
+    def __init__(self, callbacks=()):
+        self.callbacks = list(callbacks)
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def _emit(self, event, fields):
+        for callback in self.callbacks:
+            callback(event, fields)
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=SECONDS_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def request(self, provider, endpoint, status, seconds, bytes_sent, bytes_received, chars):
+        """Record one HTTP attempt, `status` is None if it failed to connect."""
+        labels = {'provider': provider, 'endpoint': endpoint}
+        self.inc('aomame_requests_total', dict(labels, status=status or 'error'))
+        self.observe('aomame_request_seconds', labels, seconds)
+        self.inc('aomame_bytes_sent_total', labels, bytes_sent)
+        self.inc('aomame_bytes_received_total', labels, bytes_received)
+        if status is not None and 200 <= status < 300:
+            self.inc('aomame_chars_billed_total', {'provider': provider}, chars)
+        self._emit('request', dict(labels, status=status, seconds=seconds, bytes_sent=bytes_sent,
+                                   bytes_received=bytes_received, chars=chars))
+
+    def retry(self, provider, endpoint, status, delay):
+        """Record a retry after `delay` seconds, `status` is None after a connection error."""
+        labels = {'provider': provider, 'endpoint': endpoint}
+        self.inc('aomame_retries_total', dict(labels, status=status or 'error'))
+        self._emit('retry', dict(labels, status=status, delay=delay))
+
+    def deduplicated(self, provider, chars):
+        """Record `chars` characters not sent by one call because they
+        repeated other texts, counted once per target language."""
+        self.inc('aomame_chars_deduplicated_total', {'provider': provider}, chars)
+        self._emit('deduplicated', {'provider': provider, 'chars': chars})
+
+    def batch(self, provider, batch, limits):
+        """Record how full a batch request is and return a span timing it."""
+        chars = sum(map(len, batch))
+        labels = {'provider': provider}
+        self.inc('aomame_batches_total', labels)
+        self.inc('aomame_batch_items_total', labels, len(batch))
+        self.observe('aomame_batch_fill_ratio', dict(labels, limit='items'),
+                     len(batch) / limits.max_items, RATIO_BUCKETS)
+        if limits.max_chars:
+            self.observe('aomame_batch_fill_ratio', dict(labels, limit='chars'),
+                         chars / limits.max_chars, RATIO_BUCKETS)
+        self._emit('batch', dict(labels, items=len(batch), chars=chars))
+        return self.span('batch', provider=provider)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the body of a `with` block as a span named `name`."""
+        start, wall = time.perf_counter(), time.time()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe('aomame_span_seconds', dict(labels, span=name), seconds)
+            self._emit('span', dict(labels, span=name, start=wall, seconds=seconds))
+
+    def snapshot(self):
+        """JSON-serialisable dict of every counter and histogram."""
+        with self._lock:
+            return {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items(), key=str)],
+                'histograms': [{'name': name, 'labels': dict(labels), 'buckets': list(h.buckets),
+                                'counts': list(h.counts), 'sum': h.sum, 'count': h.count}
+                               for (name, labels), h in sorted(self.histograms.items(), key=str)],
+            }
+
+    def merge(self, snapshot):
+        """Add the counters and histograms of a snapshot(), e.g. from another process."""
+        with self._lock:
+            for counter in snapshot['counters']:
+                key = (counter['name'], tuple(sorted(counter['labels'].items())))
+                self.counters[key] = self.counters.get(key, 0) + counter['value']
+            for h in snapshot['histograms']:
+                key = (h['name'], tuple(sorted(h['labels'].items())))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(tuple(h['buckets']))
+                histogram.counts = [a + b for a, b in zip(histogram.counts, h['counts'])]
+                histogram.sum += h['sum']
+                histogram.count += h['count']
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        """Every metric in the Prometheus text exposition format."""
+        lines, typed = [], set()
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items(), key=str):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} counter')
+                    typed.add(name)
+                lines.append(f'{name}{{{_labels(labels)}}} {value}')
+            for (name, labels), h in sorted(self.histograms.items(), key=str):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} histogram')
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                    cumulative += count
+                    bucket_labels = _labels(labels + (('le', bound),))
+                    lines.append(f'{name}_bucket{{{bucket_labels}}} {cumulative}')
+                lines.append(f'{name}_sum{{{_labels(labels)}}} {h.sum}')
+                lines.append(f'{name}_count{{{_labels(labels)}}} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Short human-readable report of the requests made per provider."""
+        totals = {}
+        with self._lock:
+            for (name, labels), value in self.counters.items():
+                provider = dict(labels).get('provider')
+                totals.setdefault(provider, {}).setdefault(name, 0)
+                totals[provider][name] += value
+            latencies = {}
+            for (name, labels), h in self.histograms.items():
+                if name == 'aomame_request_seconds':
+                    provider = dict(labels)['provider']
+                    merged = latencies.setdefault(provider, Histogram(h.buckets))
+                    merged.counts = [a + b for a, b in zip(merged.counts, h.counts)]
+                    merged.sum += h.sum
+                    merged.count += h.count
+        lines = []
+        for provider, counts in sorted(totals.items()):
+            latency = latencies.get(provider, Histogram(SECONDS_BUCKETS))
+            batches = counts.get('aomame_batches_total', 0)
+            lines.append(
+                f"{provider}: {counts.get('aomame_requests_total', 0)} requests, "
+                f"{counts.get('aomame_retries_total', 0)} retries, "
+                f"{batches} batches of {counts.get('aomame_batch_items_total', 0) / max(1, batches):.1f} texts, "
+                f"{counts.get('aomame_chars_billed_total', 0)} chars billed, "
+                f"{counts.get('aomame_chars_deduplicated_total', 0)} deduplicated, "
+                f"{counts.get('aomame_bytes_sent_total', 0)} bytes sent, "
+                f"{counts.get('aomame_bytes_received_total', 0)} received, "
+                f"latency mean {latency.sum / max(1, latency.count):.3f}s "
+                f"p50 <= {latency.quantile(0.5)}s p99 <= {latency.quantile(0.99)}s")
+        return '\n'.join(lines)
+
+
+class NullMetrics(Metrics):
+    """Default of every client, records nothing. Callers check `enabled`
+    to skip timing the hot path altogether."""
+    enabled = False
+
+    def request(self, *args, **kwargs):
+        pass
+
+    def retry(self, *args, **kwargs):
+        pass
+
+    def deduplicated(self, *args, **kwargs):
+        pass
+
+    def batch(self, provider, batch, limits):
+        return _NULL_SPAN
+
+    def span(self, name, **labels):
+        return _NULL_SPAN
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+NULL_METRICS = NullMetrics()
+
+
+def _request_size(response):
+    request = getattr(response, 'request', None)
+    if request is None:
+        return 0
+    body = request.body
+    return len(request.url) + (len(body) if body is not None else 0)
+
+
+def instrumented_call(metrics, rate_limiter, provider, endpoint, send, chars=0):
+    """
+    RateLimiter.call() recording every attempt, retry and the whole call
+    in `metrics`. With metrics disabled, just RateLimiter.call().
+    """
+    if not metrics.enabled:
+        return rate_limiter.call(send, chars=chars)
+
+    def timed_send():
+        start = time.perf_counter()
+        try:
+            response = send()
+        except Exception:
+            metrics.request(provider, endpoint, None, time.perf_counter() - start, 0, 0, chars)
+            raise
+        metrics.request(provider, endpoint, response.status_code, time.perf_counter() - start,
+                        _request_size(response), len(response.content), chars)
+        return response
+
+    on_retry = lambda status, delay: metrics.retry(provider, endpoint, status, delay)
+    with metrics.span('call', provider=provider, endpoint=endpoint):
+        return rate_limiter.call(timed_send, chars=chars, on_retry=on_retry)
@@ -1,18 +1,56 @@
+import os
 import uuid
-from unittest.mock import Mock
-
-import requests
-from tqdm import tqdm
-from requests.models import Response
+import threading
 
+from aomame.base import BaseTranslator
+from aomame.batching import MICROSOFT_DETECT_LIMITS, MICROSOFT_LIMITS, translate_batches
+from aomame.cache import cached_detect_sents, cached_translate_sents_multi
 from aomame.exceptions import ResponseError
+from aomame.metrics import instrumented_call
+from aomame.segment import chunk_text, join_segments, segment_text
+from aomame.utils import METADATA_DIR, cached_json, translate_detected_multi, translate_unique
+
+def parse_languages(reponse_json):
+    """Map language codes to names from the languages endpoint response."""
+    return {lang_code:_dict['name'] for lang_code, _dict in
+            reponse_json['translation'].items()}
+
+
+def parse_scripts(reponse_json):
+    """Map script codes to names from the languages endpoint response."""
+    _scripts = {}
+    for l, details in reponse_json['transliteration'].items():
+        for s in details['scripts']:
+            for _s in s['toScripts']:
+                if _s['name'] == 'Hat':
+                    _scripts[_s['code'].lower()] = 'Han Traditional'
+                elif _s['name'] == 'Han':
+                    _scripts[_s['code'].lower()] = 'Han Simplified'
+                else:
+                    _scripts[_s['code'].lower()] = _s['name']
+    return _scripts
+
 
-class MicrosoftTranslator:
+class MicrosoftTranslator(BaseTranslator):
     """Python SDK for
     https://azure.microsoft.com/en-us/services/cognitive-services/translator/
     """
-    def __init__(self, host, key):
-        self.host, self.key = host, key
+    provider = 'microsoft'
+    batch_limits = MICROSOFT_LIMITS
+
+    def __init__(self, host, key, max_workers=1, session=None, pool_size=None,
+                 timeout=None, keep_alive=True,
+                 requests_per_second=None, chars_per_minute=None, max_retries=5,
+                 rate_limiter=None, cache=None, metadata_dir=METADATA_DIR, metadata_ttl=86400,
+                 segmenter='local', scheme='https', metrics=None):
+        super().__init__(host, key, max_workers=max_workers, session=session,
+                         pool_size=pool_size, timeout=timeout, keep_alive=keep_alive,
+                         requests_per_second=requests_per_second,
+                         chars_per_minute=chars_per_minute, max_retries=max_retries,
+                         rate_limiter=rate_limiter, cache=cache, metrics=metrics)
+        # How documents over the request limit are split into sentences,
+        # 'local' (no extra request) or 'remote' (the breaksentence endpoint).
+        self.segmenter = segmenter
         # See "Add headers" section from
         # https://docs.microsoft.com/en-us/azure/cognitive-services/translator/quickstart-translate?pivots=programming-language-python
         self.headers = {
@@ -26,71 +64,106 @@ class MicrosoftTranslator:
             'transliterate': '/transliterate?api-version=3.0',
             'languages': '/languages?api-version=3.0',
             'breaksentence': 'breaksentence?api-version=3.0',
+            'detect': '/detect?api-version=3.0',
         }
-        self.urls = {k:"https://" + self.host + '/' + v
+        self.urls = {k:scheme + "://" + self.host + '/' + v
                      for k,v in self.endpoints.items()}
 
-        # Pre-populate the list of languages for translation.
-        self._languages = self.languages()
+        # The languages/scripts metadata is fetched lazily, once, and kept in
+        # `metadata_dir` for `metadata_ttl` seconds, so constructing a client
+        # makes no network calls. Set `metadata_dir` to None to skip the disk.
+        self.metadata_dir, self.metadata_ttl = metadata_dir, metadata_ttl
+        self._metadata = None
+        self._metadata_lock = threading.Lock()
 
-        # Pre-populate the list of languages for transliteration
-        self._scripts = self.scripts()
-
-    def api_call(self, operation, method, params=None, json=None):
+    def api_call(self, operation, method, params=None, json=None, chars=0):
         """Wrapper class over API calls."""
         url = self.urls[method] + params if params else self.urls[method]
-        response = operation(url, headers=self.headers, json=json)
-        return response
+        send = lambda: operation(url, headers=self.headers, json=json, timeout=self.timeout)
+        return instrumented_call(self.metrics, self.rate_limiter, self.provider, method,
+                                 send, chars=chars)
+
+    def _metadata_path(self):
+        if self.metadata_dir:
+            return os.path.join(self.metadata_dir, f'{self.provider}-{self.host}-languages.json')
+
+    def _fetch_metadata(self):
+        response = self.api_call(self.session.get, 'languages')
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise ResponseError(response.json())
+
+    def metadata(self):
+        """Return the response of the languages endpoint, fetched at most once."""
+        with self._metadata_lock:
+            if self._metadata is None:
+                self._metadata = cached_json(self._metadata_path(), self.metadata_ttl,
+                                             self._fetch_metadata)
+            return self._metadata
+
+    @property
+    def _languages(self):
+        return self.languages()
+
+    @property
+    def _scripts(self):
+        return self.scripts()
 
     def languages(self):
         """Return list of languages available for translation."""
-        reponse_json = self.api_call(requests.get, 'languages').json()
-        return {lang_code:_dict['name'] for lang_code, _dict in
-                reponse_json['translation'].items()}
+        return parse_languages(self.metadata())
 
     def scripts(self):
         """Return list of scripts available for transliteration."""
-        _scripts = {}
-        reponse_json = self.api_call(requests.get, 'languages').json()
-        for l, details in reponse_json['transliteration'].items():
-            for s in details['scripts']:
-                for _s in s['toScripts']:
-                    if _s['name'] == 'Hat':
-                        _scripts[_s['code'].lower()] = 'Han Traditional'
-                    elif _s['name'] == 'Han':
-                        _scripts[_s['code'].lower()] = 'Han Simplified'
-                    else:
-                        _scripts[_s['code'].lower()] = _s['name']
-        return _scripts
+        return parse_scripts(self.metadata())
 
     def transliterate(self, text, srclang, from_script, to_script):
         params = f'&language={srclang}&fromScript={from_script}&toScript={to_script}'
-        response = self.api_call(requests.post, 'transliterate',
-                                 params=params, json=[{'Text': text}])
+        response = self.api_call(self.session.post, 'transliterate',
+                                 params=params, json=[{'Text': text}], chars=len(text))
         if response.status_code == 200:
             return response.json()[0]['text']
         else:
             raise ResponseError(response.json())
 
-    def translate(self, text, srclang, trglang):
-        params = f'&from={srclang}&to={trglang}'
-        if len(text) < 5000:
-            response = self.api_call(requests.post, 'translate',
-                                     params=params, json=[{'Text': text}])
-            if response.status_code == 200:
-                return response.json()[0]['translations'][-1]['text']
-            else:
-                raise ResponseError(response.json())
+    def _detect_batch(self, batch):
+        with self.metrics.batch(self.provider, batch, MICROSOFT_DETECT_LIMITS):
+            response = self.api_call(self.session.post, 'detect',
+                                     json=[{'Text': t} for t in batch], chars=sum(map(len, batch)))
+        if response.status_code == 200:
+            return [d['language'] for d in response.json()]
         else:
-            # Catch special case where len(t) >= 5000
-            # See https://docs.microsoft.com/en-us/azure/cognitive-services/translator/request-limits#character-and-array-limits-per-request
-            sentences = self.break_sent(text, srclang)
-            return ''.join(self.translate_sents(sentences, srclang, trglang, quiet=True))
+            raise ResponseError(response.json())
+
+    def detect_sents(self, texts, quiet=False, max_workers=None):
+        """Detect the language of a list of texts with batched requests to
+        the detect endpoint. Repeated and cached texts are not sent."""
+        # The start of a text too long for a request is enough to detect it.
+        detect = lambda uniques: cached_detect_sents(
+            self.cache, self.provider, uniques,
+            lambda misses: translate_batches(
+                misses, MICROSOFT_DETECT_LIMITS, self._detect_batch,
+                lambda text: self._detect_batch([text[:MICROSOFT_DETECT_LIMITS.max_chars]])[0],
+                max_workers=max_workers or self.max_workers, quiet=quiet))
+        languages, _ = translate_unique(texts, detect)
+        return languages
+
+    def segment(self, text, srclang, max_chars=None):
+        """Split a document into sentences that fit in a request, locally or
+        with the breaksentence endpoint depending on `self.segmenter`."""
+        sentences = None
+        if self.segmenter == 'remote':
+            # breaksentence has the same limit as translate, documents over it
+            # are first cut at local sentence boundaries.
+            sentences = [sentence for chunk in chunk_text(text, self.batch_limits.max_chars)
+                         for sentence in self.break_sent(chunk, srclang)]
+        return segment_text(text, max_chars or self.batch_limits.max_chars, sentences)
 
     def break_sent(self, text, srclang):
         params = f'&language={srclang}'
-        response = self.api_call(requests.post, 'breaksentence',
-                                 params=params, json=[{'Text': text}])
+        response = self.api_call(self.session.post, 'breaksentence',
+                                 params=params, json=[{'Text': text}], chars=len(text))
         if response.status_code == 200:
             start = 0
             sentences = []
@@ -101,57 +174,61 @@ class MicrosoftTranslator:
         else:
             raise ResponseError(response.json())
 
-    def _mock_response_with_translation(self, translation):
-        # Create the mock request.
-        response = Mock(spec=Response)
-        response.status_code = 200
-        response.json.return_value = [{'translations': [{'text': translation}]}]
-        return response
-
-    def _get_multiple_translations(self, texts, srclang, trglang, quiet=False):
-        params = f'&from={srclang}&to={trglang}'
-        # Splitting texts into batches.
-        # See https://docs.microsoft.com/en-us/azure/cognitive-services/translator/request-limits
-        responses = []
-        batch = []
-        len_batch = 0
-        for t in tqdm(texts, disable=quiet):
-            if len_batch + len(t) < 1000 and len(batch) < 10:
-                batch.append({'Text':t})
-                len_batch += len(t)
-            else:
-                if batch: # Process existing batch.
-                    yield requests.post(self.urls['translate'] + params,
-                                        headers=self.headers,json=batch)
-
-                if len(t) < 5000: # Clear this batch, prepare the next batch.
-                    batch = [{'Text':t}]
-                    len_batch = len(t)
-                else:
-                    # Catch special case where len(t) >= 5000
-                    # See https://docs.microsoft.com/en-us/azure/cognitive-services/translator/request-limits#character-and-array-limits-per-request
-                    # Get the self.translate() that calls breaksentence,
-                    translation = self.translate(t, srclang, trglang)
-                    response = self._mock_response_with_translation(translation)
-                    yield response
-                    # Clear this batch, prepare the next batch.
-                    batch = []
-                    len_batch = 0
-
-        # Process last batch.
-        if batch:
-            yield requests.post(self.urls['translate'] + params,
-                                headers=self.headers,json=batch)
-
-    def translate_sents(self, texts, srclang, trglang, quiet=False):
-        translations = []
-        for response in self._get_multiple_translations(texts, srclang, trglang, quiet=quiet):
-            if response.status_code == 200:
-                for t in response.json():
-                    trg = t['translations'][0]['text']
-                    translations.append(trg)
-            else:
-                raise ResponseError(response.json())
+    def _translate_batch(self, batch, srclang, trglang):
+        return [ts[0] for ts in self._translate_batch_multi(batch, srclang, [trglang])]
+
+    def _translate_batch_multi(self, batch, srclang, trglangs):
+        # The translate endpoint accepts several `to` parameters and returns
+        # the translations in the same order, each target is billed.
+        params = f'&from={srclang}' + ''.join(f'&to={trglang}' for trglang in trglangs)
+        with self.metrics.batch(self.provider, batch, self.batch_limits.per_target(len(trglangs))):
+            response = self.api_call(self.session.post, 'translate', params=params,
+                                     json=[{'Text': t} for t in batch],
+                                     chars=sum(map(len, batch)) * len(trglangs))
+        if response.status_code == 200:
+            return [tuple(t['text'] for t in item['translations']) for item in response.json()]
+        else:
+            raise ResponseError(response.json())
+
+    def translate_sents_multi(self, texts, srclang, trglangs, quiet=False, max_workers=None,
+                              normalize_whitespace=False):
+        """Translate a list of texts into several target languages, sending
+        each batch once for all targets. With srclang='auto' the texts are
+        grouped by detected language, see utils.translate_detected_multi().
+        Returns:
+            A {trglang: translations} dict.
+        """
+        if srclang == 'auto':
+            return translate_detected_multi(self, texts, trglangs, quiet=quiet,
+                                            max_workers=max_workers,
+                                            normalize_whitespace=normalize_whitespace)
+        translate = lambda uniques: cached_translate_sents_multi(
+            self.cache, self.provider, uniques, srclang, trglangs,
+            lambda misses: self._translate_sents_multi(misses, srclang, trglangs,
+                                                       quiet=quiet, max_workers=max_workers))
+        results, chars_saved = translate_unique(
+            texts, translate, normalize_whitespace=normalize_whitespace)
+        # Every target is billed, like a translate_sents() per target.
+        self.metrics.deduplicated(self.provider, chars_saved * len(trglangs))
+        return {trglang: [result[k] for result in results] for k, trglang in enumerate(trglangs)}
+
+    def _translate_sents(self, texts, srclang, trglang, quiet=False, max_workers=None):
+        translations = [ts[0] for ts in self._translate_sents_multi(
+            texts, srclang, [trglang], quiet=quiet, max_workers=max_workers)]
         # Sanity check to check that all sentences are translated.
         assert len(translations) == len(texts)
         return translations
+
+    def _translate_sents_multi(self, texts, srclang, trglangs, quiet=False, max_workers=None):
+        # Texts too long for a request are split into sentences that are
+        # batched and sent concurrently with the other texts, see
+        # https://docs.microsoft.com/en-us/azure/cognitive-services/translator/request-limits#character-and-array-limits-per-request
+        limits = self.batch_limits.per_target(len(trglangs))
+        join = lambda segments, results: tuple(join_segments(segments, translations)
+                                               for translations in zip(*results))
+        return translate_batches(
+            texts, limits,
+            lambda batch: self._translate_batch_multi(batch, srclang, trglangs),
+            max_workers=max_workers or self.max_workers, quiet=quiet,
+            split_oversized=lambda text: self.segment(text, srclang, limits.max_chars),
+            join=join)
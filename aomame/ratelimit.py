@@ -0,0 +1,166 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+# Status codes worth retrying, see e.g.
+# https://docs.microsoft.com/en-us/azure/cognitive-services/translator/reference/v3-0-reference#errors
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate` tokens per second and holding
+    at most `capacity` tokens. Callers reserve tokens up front and sleep off
+    any debt, so concurrent callers are served in the order they arrive.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens=1):
+        """Take `tokens` from the bucket and return the number of seconds to
+        wait before using them."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def acquire(self, tokens=1):
+        """Take `tokens` from the bucket, blocking until they are available."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def available(self):
+        """Return the number of tokens currently in the bucket."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+def retry_after(response):
+    """Return the delay in seconds requested by a Retry-After header, or None."""
+    value = response.headers.get('Retry-After') if response.headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Per-provider request scheduler shared by all threads of a translator.
+
+    Requests wait on a requests/sec and a characters/minute token bucket.
+    Responses with a retryable status code and connection errors are retried
+    with jittered exponential backoff, honouring Retry-After headers. A 429
+    pauses every caller of the limiter, not just the throttled one.
+    Args:
+        requests_per_second: Request rate limit, None for no limit.
+        chars_per_minute: Character rate limit, None for no limit.
+        max_retries: Number of retries before the last response is returned.
+        backoff: Initial backoff in seconds, doubled after each retry.
+        max_backoff: Upper bound on a single backoff in seconds.
+        retry_statuses: Status codes that are retried.
+    """
+    def __init__(self, requests_per_second=None, chars_per_minute=None,
+                 max_retries=5, backoff=1, max_backoff=60,
+                 retry_statuses=RETRYABLE_STATUS):
+        self.requests = TokenBucket(requests_per_second) if requests_per_second else None
+        self.chars = (TokenBucket(chars_per_minute / 60, chars_per_minute)
+                      if chars_per_minute else None)
+        self.max_retries, self.backoff, self.max_backoff = max_retries, backoff, max_backoff
+        self.retry_statuses = retry_statuses
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, chars=0):
+        """Reserve one request of `chars` characters and return the number of
+        seconds to wait before sending it."""
+        with self._lock:
+            wait = max(0, self._resume_at - time.monotonic())
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.chars is not None and chars:
+            wait = max(wait, self.chars.reserve(chars))
+        return wait
+
+    def estimate_wait(self, chars=0):
+        """Return the number of seconds a request of `chars` characters would
+        wait if it were sent now, without reserving anything."""
+        with self._lock:
+            wait = max(0, self._resume_at - time.monotonic())
+        if self.requests is not None:
+            wait = max(wait, (1 - self.requests.available()) / self.requests.rate)
+        if self.chars is not None and chars:
+            wait = max(wait, (chars - self.chars.available()) / self.chars.rate)
+        return wait
+
+    def _pause_all(self, delay):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    def _backoff(self, attempt):
+        # "Full jitter", see https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def retry_delay(self, response, attempt):
+        """Return the number of seconds to wait before retrying `response`
+        after `attempt` retries, or None if it should not be retried."""
+        if response.status_code not in self.retry_statuses or attempt == self.max_retries:
+            return None
+        delay = retry_after(response)
+        if delay is None:
+            delay = self._backoff(attempt)
+        else:
+            delay += random.uniform(0, self.backoff)
+        if response.status_code == 429:
+            self._pause_all(delay)
+        return delay
+
+    def error_delay(self, attempt):
+        """Like retry_delay() for a request that failed to connect or timed out."""
+        return None if attempt == self.max_retries else self._backoff(attempt)
+
+    def call(self, send, chars=0, on_retry=None):
+        """
+        Call `send()` once the limits allow it, retrying retryable failures.
+        Args:
+            send: Callable issuing the HTTP request and returning its response.
+            chars: Number of characters billed by this request.
+            on_retry: Optional callable called as `on_retry(status, delay)`
+                before every retry, `status` is None after a connection error.
+        """
+        for attempt in range(self.max_retries + 1):
+            wait = self.reserve(chars)
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout):
+                status, delay = None, self.error_delay(attempt)
+                if delay is None:
+                    raise
+            else:
+                status, delay = response.status_code, self.retry_delay(response, attempt)
+                if delay is None:
+                    return response
+            if on_retry is not None:
+                on_retry(status, delay)
+            time.sleep(delay)
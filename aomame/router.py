@@ -0,0 +1,211 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from tqdm import tqdm
+
+from aomame.base import BaseTranslator
+from aomame.exceptions import ResponseError
+from aomame.metrics import NULL_METRICS
+from aomame.utils import imap_ordered, translate_unique
+
+
+class _Backend:
+    """Routing state of one translator."""
+    def __init__(self, translator, name, quota=None):
+        self.translator, self.name = translator, name
+        # Remaining characters this translator may translate, None for no limit.
+        self.remaining = quota
+        # Moving average of the seconds taken per character translated,
+        # None until the first chunk comes back.
+        self.seconds_per_char = None
+        self.inflight, self.failures, self.down_until = 0, 0, 0.0
+        self.chunks, self.chars, self.hedges_won = 0, 0, 0
+
+
+class RouterTranslator(BaseTranslator):
+    """
+    Translator spreading the batches of a job over several translators.
+
+    Texts are translated in chunks. Each chunk goes to the translator with
+    the lowest expected time, from a moving average of its observed latency,
+    the chunks it already has in flight and its rate limiter's backlog,
+    among the translators with quota left. A translator that fails is taken
+    out of rotation for a growing cool-down and the chunk goes to the next
+    one. With `hedge_after`, a chunk that takes longer than that is also
+    sent to the next best translator and the first result wins.
+    Args:
+        translators: Translator instances, e.g. MicrosoftTranslator, GoogleTranslator.
+        quotas: {name: characters} budget of translators, the others are
+            unlimited. A provider name sets the budget of each of its
+            translators without a quota of their own.
+        names: Names of the translators in quotas and stats(), by default
+            their provider, numbered if several share one, e.g. 'google-1'
+            and 'google-2'.
+        max_workers: Number of chunks kept in flight.
+        chunk_size: Maximum number of texts per chunk.
+        hedge_after: Seconds after which a chunk is hedged, None to never hedge.
+        alpha: Weight of the newest observation in the latency moving average.
+        cooldown: Seconds a failed translator sits out, doubled on every
+            consecutive failure up to `max_cooldown`.
+        metrics: Optional aomame.metrics.Metrics counting the characters
+            saved by deduplication, pass the same instance to the translators
+            for their requests.
+    """
+    provider = 'router'
+
+    def __init__(self, translators, quotas=None, max_workers=4, chunk_size=100,
+                 hedge_after=None, alpha=0.3, cooldown=5, max_cooldown=300, metrics=None,
+                 names=None):
+        quotas = quotas or {}
+        names = names or self._default_names(translators)
+        if len(names) != len(translators) or len(set(names)) != len(names):
+            raise ValueError("names must give every translator a different name")
+        self.backends = [_Backend(t, name, quotas.get(name, quotas.get(t.provider)))
+                         for t, name in zip(translators, names)]
+        self.max_workers, self.chunk_size = max_workers, chunk_size
+        self.hedge_after, self.alpha = hedge_after, alpha
+        self.cooldown, self.max_cooldown = cooldown, max_cooldown
+        self.metrics = metrics or NULL_METRICS
+        # The translators consult their own caches.
+        self.cache = None
+        self._lock = threading.Lock()
+        # Runs the translator calls, hedged calls that lose keep running here
+        # and still update the latency averages.
+        self._executor = ThreadPoolExecutor(max_workers=2 * max_workers * len(self.backends))
+
+    @staticmethod
+    def _default_names(translators):
+        providers = [t.provider for t in translators]
+        numbers = {}
+        names = []
+        for provider in providers:
+            if providers.count(provider) == 1:
+                names.append(provider)
+            else:
+                numbers[provider] = numbers.get(provider, 0) + 1
+                names.append(f'{provider}-{numbers[provider]}')
+        return names
+
+    def _expected_seconds(self, backend, chars):
+        # Untried translators look free, so that every one gets measured.
+        latency = (backend.seconds_per_char or 0) * chars * (1 + backend.inflight)
+        return latency + backend.translator.rate_limiter.estimate_wait(chars)
+
+    def _choose(self, chars, exclude):
+        """Reserve the translator expected to finish a chunk of `chars`
+        characters first, or None if none is available."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude
+                          and (b.remaining is None or b.remaining >= chars)]
+            # Translators cooling down are only tried when nothing else is left.
+            healthy = [b for b in candidates if b.down_until <= now] or candidates
+            if not healthy:
+                return None
+            # Ties, e.g. between untried translators, go to the least busy.
+            backend = min(healthy, key=lambda b: (self._expected_seconds(b, chars), b.inflight))
+            backend.inflight += 1
+            if backend.remaining is not None:
+                backend.remaining -= chars
+            return backend
+
+    def _call(self, backend, chunk, work):
+        chars = sum(map(len, chunk))
+        start = time.monotonic()
+        try:
+            translations = work(backend.translator, chunk)
+            assert len(translations) == len(chunk)
+        except Exception:
+            with self._lock:
+                backend.inflight -= 1
+                backend.failures += 1
+                backend.down_until = time.monotonic() + min(
+                    self.max_cooldown, self.cooldown * 2 ** (backend.failures - 1))
+                if backend.remaining is not None:
+                    backend.remaining += chars
+            raise
+        seconds = (time.monotonic() - start) / max(1, chars)
+        with self._lock:
+            backend.inflight -= 1
+            backend.failures, backend.down_until = 0, 0.0
+            backend.chunks += 1
+            backend.chars += chars
+            if backend.seconds_per_char is None:
+                backend.seconds_per_char = seconds
+            else:
+                backend.seconds_per_char += self.alpha * (seconds - backend.seconds_per_char)
+        return translations
+
+    def _run_chunk(self, chunk, work):
+        """Run `work(translator, chunk)` on the chosen translators."""
+        chars = sum(map(len, chunk))
+        pending, tried, hedged, error = {}, [], False, None
+        while True:
+            if not pending:
+                backend = self._choose(chars, tried)
+                if backend is None:
+                    if error is not None:
+                        raise error
+                    raise ResponseError(f"No translator has quota left for {chars} characters")
+                tried.append(backend)
+                pending[self._executor.submit(self._call, backend, chunk, work)] = backend
+            timeout = self.hedge_after if not hedged else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Too slow, race the next best translator against it.
+                hedged = True
+                backend = self._choose(chars, tried)
+                if backend is not None:
+                    tried.append(backend)
+                    pending[self._executor.submit(self._call, backend, chunk, work)] = backend
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    translations = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if hedged and backend is not tried[0]:
+                    with self._lock:
+                        backend.hedges_won += 1
+                return translations
+
+    def _route(self, texts, work, quiet=False, max_workers=None):
+        """Run `work(translator, chunk)` over chunks of `texts`, in order."""
+        chunks = [texts[i:i+self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        results = []
+        with tqdm(total=len(texts), disable=quiet) as progress:
+            for result in imap_ordered(lambda chunk: self._run_chunk(chunk, work),
+                                       chunks, max_workers or self.max_workers):
+                results.extend(result)
+                progress.update(len(result))
+        return results
+
+    def _translate(self, text, srclang, trglang):
+        return self._translate_sents([text], srclang, trglang, quiet=True)[0]
+
+    def _translate_sents(self, texts, srclang, trglang, quiet=False, max_workers=None):
+        """Translate a list of texts over the routed translators, in order."""
+        work = lambda translator, chunk: translator.translate_sents(chunk, srclang, trglang,
+                                                                    quiet=True, max_workers=1)
+        return self._route(texts, work, quiet=quiet, max_workers=max_workers)
+
+    def detect_sents(self, texts, quiet=False, max_workers=None):
+        """Detect the language of a list of texts over the routed translators, in order."""
+        work = lambda translator, chunk: translator.detect_sents(chunk, quiet=True, max_workers=1)
+        languages, _ = translate_unique(
+            texts, lambda uniques: self._route(uniques, work, quiet=quiet, max_workers=max_workers))
+        return languages
+
+    def stats(self):
+        """Return the routing state of every translator, by name."""
+        with self._lock:
+            return {b.name: {'chunks': b.chunks, 'chars': b.chars, 'inflight': b.inflight,
+                             'seconds_per_char': b.seconds_per_char, 'failures': b.failures,
+                             'remaining': b.remaining, 'hedges_won': b.hedges_won}
+                    for b in self.backends}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
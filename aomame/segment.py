@@ -0,0 +1,73 @@
+import re
+
+# Sentence-final punctuation, with any closing quotes or brackets, followed by
+# whitespace. CJK full stops don't need the whitespace.
+_SENTENCE_END = re.compile(r'[.!?…]+["\'”’)\]]*\s+'
+                           r'|[。！？]+["\'”’」』)\]）]*\s*')
+
+
+def split_sentences(text):
+    """
+    Split `text` after sentence-final punctuation. Whitespace stays attached
+    to the end of the sentence before it, so ''.join() restores `text`.
+    """
+    sentences, start = [], 0
+    for match in _SENTENCE_END.finditer(text):
+        sentences.append(text[start:match.end()])
+        start = match.end()
+    if start < len(text):
+        sentences.append(text[start:])
+    return sentences
+
+
+def split_long(text, max_chars):
+    """Cut `text` into pieces of at most `max_chars`, at the last whitespace
+    before the limit where there is one."""
+    pieces = []
+    while len(text) > max_chars:
+        cut = max(text.rfind(' ', 0, max_chars), text.rfind('\n', 0, max_chars)) + 1
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(text[:cut])
+        text = text[cut:]
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def segment_text(text, max_chars, sentences=None):
+    """
+    Split a document into sentences of at most `max_chars` characters.
+    Args:
+        text: The document.
+        max_chars: Maximum length of a segment.
+        sentences: Sentences of `text` from another segmenter, e.g. the
+            Microsoft breaksentence endpoint, instead of split_sentences().
+    """
+    if sentences is None:
+        sentences = split_sentences(text)
+    return [piece for sentence in sentences for piece in split_long(sentence, max_chars)]
+
+
+def chunk_text(text, max_chars):
+    """Cut `text` into chunks of at most `max_chars` characters made of whole
+    segment_text() segments, e.g. for a remote segmenter with a size limit."""
+    chunks, chunk = [], ''
+    for segment in segment_text(text, max_chars):
+        if len(chunk) + len(segment) > max_chars:
+            chunks.append(chunk)
+            chunk = ''
+        chunk += segment
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def join_segments(segments, translations):
+    """Join the translations of segment_text() segments, keeping the
+    whitespace that followed each source segment."""
+    joined = []
+    for segment, translation in zip(segments, translations):
+        trailing = segment[len(segment.rstrip()):]
+        joined.append(translation if translation.endswith(trailing) else translation.rstrip() + trailing)
+    return ''.join(joined)
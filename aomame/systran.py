@@ -1,14 +1,38 @@
-import requests
 from tqdm import tqdm
 
+from aomame.base import BaseTranslator
+from aomame.batching import SYSTRAN_LIMITS, translate_batches
+from aomame.cache import cached_detect_sents
 from aomame.exceptions import ResponseError
-from aomame.utils import retry
+from aomame.metrics import instrumented_call
+from aomame.ratelimit import RETRYABLE_STATUS
+from aomame.segment import segment_text
+from aomame.utils import imap_ordered, translate_unique
 
-class SystranTranslator:
+
+def is_input_error(status_code):
+    """Whether a failed request was rejected for its content, as opposed to
+    throttling, timeouts and server errors that sending the texts again one
+    by one would only multiply."""
+    return 400 <= status_code < 500 and status_code not in RETRYABLE_STATUS
+
+
+class SystranTranslator(BaseTranslator):
     """Python SDK for
     https://rapidapi.com/systran/api/systran-io-translation-and-nlp"""
-    def __init__(self, host, key):
-        self.host, self.key = host, key
+    provider = 'systran'
+    batch_limits = SYSTRAN_LIMITS
+
+    def __init__(self, host, key, max_workers=1, session=None, pool_size=None,
+                 timeout=None, keep_alive=True,
+                 requests_per_second=None, chars_per_minute=None, max_retries=5,
+                 rate_limiter=None, cache=None, scheme='https',
+                 metrics=None):
+        super().__init__(host, key, max_workers=max_workers, session=session,
+                         pool_size=pool_size, timeout=timeout, keep_alive=keep_alive,
+                         requests_per_second=requests_per_second,
+                         chars_per_minute=chars_per_minute, max_retries=max_retries,
+                         rate_limiter=rate_limiter, cache=cache, metrics=metrics)
         self.headers = {'x-rapidapi-host': host, 'x-rapidapi-key': key}
 
         self.endpoints = {'lemmatize': "nlp/morphology/extract/lemma",
@@ -18,54 +42,104 @@ class SystranTranslator:
                           'ner_annotate': "nlp/ner/extract/annotations",
                           'tokenize': "nlp/segmentation/segmentAndTokenize",
                           'translate': "translation/text/translate"}
-        self.urls = {k:"https://" + self.host + '/' + v for k,v in self.endpoints.items()}
+        self.urls = {k:scheme + "://" + self.host + '/' + v for k,v in self.endpoints.items()}
 
-    def api_call(self, operation, method, text, lang=None):
+    def api_call(self, operation, method, text, lang=None, query=None, chars=None):
         """Wrapper class over API calls."""
-        query = {"input":text,"lang":lang} if lang else {"input":text}
-        response = operation(self.urls[method],
-                                headers=self.headers,
-                                params=query)
-        return response
+        if query is None:
+            query = {"input":text,"lang":lang} if lang else {"input":text}
+        send = lambda: operation(self.urls[method],
+                                 headers=self.headers,
+                                 params=query,
+                                 timeout=self.timeout)
+        return instrumented_call(self.metrics, self.rate_limiter, self.provider, method,
+                                 send, chars=len(text) if chars is None else chars)
 
     def lemmatize(self, text, lang):
-        output = self.api_call(requests.get, 'lemmatize', text, lang).json()
+        output = self.api_call(self.session.get, 'lemmatize', text, lang).json()
         return [(tok['text'], tok['lemma']) for tok in output['lemmas']]
 
     def langid(self, text):
-        output = self.api_call(requests.get, 'langid', text).json()
+        output = self.api_call(self.session.get, 'langid', text).json()
         return [(l['lang'], l['confidence']) for l in output['detectedLanguages']]
 
     def ner(self, text, lang):
-        return self.api_call(requests.get, 'ner_annotate', text, lang).json()
+        return self.api_call(self.session.get, 'ner_annotate', text, lang).json()
 
     def pos(self, text, lang):
-        output = self.api_call(requests.get, 'pos', text, lang).json()
+        output = self.api_call(self.session.get, 'pos', text, lang).json()
         return [(token['text'], token['pos']) for token in output['partsOfSpeech']]
 
     def pos_tag(self, tokenized_text, lang):
-        output = self.api_call(requests.get, 'pos',  ' '.join(tokenized_text), lang).json()
+        output = self.api_call(self.session.get, 'pos',  ' '.join(tokenized_text), lang).json()
         return [(token['text'], token['pos']) for token in output['partsOfSpeech']]
 
     def word_tokenize(self, text, lang):
-        output = self.api_call(requests.get, 'tokenize', text, lang).json()
+        output = self.api_call(self.session.get, 'tokenize', text, lang).json()
         return [token['source'] for sent in output['segments'] for token in sent['tokens']
                 if token['type'] != 'separator']
 
     def sent_tokenize(self, text, lang):
-        output = self.api_call(requests.get, 'tokenize', text, lang).json()
+        output = self.api_call(self.session.get, 'tokenize', text, lang).json()
         return [sent['source'] for sent in output['segments']]
 
     def doc_tokenize(self, text, lang):
-        output = self.api_call(requests.get, 'tokenize', text, lang).json()
+        output = self.api_call(self.session.get, 'tokenize', text, lang).json()
         return [[token['source'] for token in sent['tokens'] if token['type'] != 'separator']
                 for sent in output['segments']]
 
-    @retry(Exception, tries=10, delay=1)
-    def translate(self, text, srclang, trglang):
+    def detect_sents(self, texts, quiet=False, max_workers=None):
+        """Detect the language of a list of texts, the most likely language of
+        langid(). The endpoint takes one document per request, up to
+        `max_workers` of them are sent at once. Repeated and cached texts are
+        not sent."""
+        def detect(misses):
+            # The start of a text too long for the URL is enough to detect it.
+            langid = lambda text: self.langid(text[:self.batch_limits.max_segment_chars()])[0][0]
+            return list(tqdm(imap_ordered(langid, misses, max_workers or self.max_workers),
+                             total=len(misses), disable=quiet))
+        languages, _ = translate_unique(
+            texts, lambda uniques: cached_detect_sents(self.cache, self.provider, uniques, detect))
+        return languages
+
+    def _translate(self, text, srclang, trglang):
+        if not self.batch_limits.fits_text(text):
+            return self._translate_sents([text], srclang, trglang, quiet=True)[0]
         query = {"source":srclang, "target":trglang,"input":text}
-        response = requests.get(self.urls['translate'], headers=self.headers, params=query)
-        return response.json()['outputs'][0]['output']
+        response = self.api_call(self.session.get, 'translate', text, query=query)
+        if response.status_code == 200:
+            output = response.json()['outputs'][0]
+            if 'error' in output:
+                raise ResponseError(output)
+            return output['output']
+        else:
+            raise ResponseError(response.json())
+
+    def _translate_batch(self, batch, srclang, trglang):
+        query = {"source":srclang, "target":trglang, "input":batch}
+        with self.metrics.batch(self.provider, batch, self.batch_limits):
+            response = self.api_call(self.session.get, 'translate', '', query=query,
+                                     chars=sum(map(len, batch)))
+        if response.status_code == 200:
+            outputs = response.json()['outputs']
+            translations = [o.get('output') if 'error' not in o else None for o in outputs]
+        elif len(batch) > 1 and is_input_error(response.status_code):
+            # One bad input can fail the whole request, isolate it below.
+            translations = [None] * len(batch)
+        else:
+            raise ResponseError(response.json())
+        # Only the failed items are sent again, one at a time.
+        return [self._translate(text, srclang, trglang) if translation is None else translation
+                for text, translation in zip(batch, translations)]
 
-    def translate_sents(self, texts, srclang, trglang):
-        return [self.translate(text, srclang, trglang) for text in tqdm(texts)]
+    def _translate_sents(self, texts, srclang, trglang, quiet=False, max_workers=None):
+        # The inputs are sent as repeated `input` query parameters, texts too
+        # long for the URL are split into sentences batched with the others.
+        translations = translate_batches(
+            texts, self.batch_limits,
+            lambda batch: self._translate_batch(batch, srclang, trglang),
+            max_workers=max_workers or self.max_workers, quiet=quiet,
+            split_oversized=lambda text: segment_text(text, self.batch_limits.max_segment_chars()))
+        # Sanity check to check that all sentences are translated.
+        assert len(translations) == len(texts)
+        return translations
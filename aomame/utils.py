@@ -1,7 +1,17 @@
 
+import os
 import sys
+import json
 import time
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
+from queue import Queue
+from threading import Thread
+
+import requests
+from requests.adapters import HTTPAdapter
 
 def retry(exceptions, tries=4, delay=3, backoff=2, logger=None):
     """
@@ -35,3 +45,239 @@ def retry(exceptions, tries=4, delay=3, backoff=2, logger=None):
             return f(*args, **kwargs)
         return f_retry  # true decorator
     return deco_retry
+
+
+def imap_ordered(func, iterable, max_workers=1):
+    """
+    Like map(func, iterable) but keeps up to `max_workers` calls in flight
+    on a thread pool. Results are yielded in input order and at most
+    `max_workers` items of `iterable` are consumed ahead of the consumer.
+    Args:
+        func: Callable applied to each item.
+        iterable: Items to process, consumed lazily.
+        max_workers: Number of concurrent calls, 1 (or None) runs inline.
+    """
+    if not max_workers or max_workers <= 1:
+        yield from map(func, iterable)
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        try:
+            for item in iterable:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Don't leave queued batches running if the consumer bails out.
+            for future in pending:
+                future.cancel()
+
+
+def make_session(pool_size=10, keep_alive=True):
+    """
+    Create a requests.Session with a connection pool sized for concurrent
+    batch dispatch, so that repeated calls reuse their TCP/TLS connections.
+    Args:
+        pool_size: Maximum number of connections kept open per host.
+        keep_alive: If False, ask the server to close every connection.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def dedupe(texts, normalize_whitespace=False):
+    """
+    Collapse repeated texts to unique segments.
+    Args:
+        texts: List of texts.
+        normalize_whitespace: Treat texts differing only in whitespace as equal.
+    Returns:
+        The unique texts, in order of first occurrence, and for every input
+        text the position of its unique segment.
+    """
+    first_seen = {}
+    uniques, positions = [], []
+    for text in texts:
+        key = ' '.join(text.split()) if normalize_whitespace else text
+        i = first_seen.get(key)
+        if i is None:
+            i = first_seen[key] = len(uniques)
+            uniques.append(text)
+        positions.append(i)
+    return uniques, positions
+
+
+def translate_unique(texts, translate, normalize_whitespace=False):
+    """
+    Translate only the unique segments of `texts` with `translate(uniques)`
+    and scatter the results back to every original position.
+    Returns:
+        The translations and the number of characters that were not sent.
+    """
+    uniques, positions = dedupe(texts, normalize_whitespace)
+    translations = translate(uniques)
+    chars_saved = sum(map(len, texts)) - sum(map(len, uniques))
+    return [translations[i] for i in positions], chars_saved
+
+
+_DONE = object()
+
+
+def prefetch(iterable, maxsize=1):
+    """
+    Consume `iterable` in a background reader thread and hand its items over
+    through a bounded queue, so that producing the next items overlaps with
+    the consumer's work while at most `maxsize` items are buffered.
+    """
+    queue = Queue(maxsize=maxsize)
+
+    def reader():
+        try:
+            for item in iterable:
+                queue.put(item)
+        except BaseException as e:
+            queue.put(_Raise(e))
+        finally:
+            queue.put(_DONE)
+
+    Thread(target=reader, daemon=True).start()
+    while True:
+        item = queue.get()
+        if item is _DONE:
+            return
+        if isinstance(item, _Raise):
+            raise item.exception
+        yield item
+
+
+class _Raise:
+    """Exception raised by the reader thread of prefetch()."""
+    def __init__(self, exception):
+        self.exception = exception
+
+
+# Directory of the on-disk metadata cache shared by all processes.
+METADATA_DIR = os.environ.get('AOMAME_CACHE_DIR',
+                              os.path.join(os.path.expanduser('~'), '.cache', 'aomame'))
+
+
+def read_cached_json(path, ttl):
+    """Return the JSON document stored at `path` if it is younger than `ttl`
+    seconds, otherwise None."""
+    if path and os.path.exists(path) and time.time() - os.path.getmtime(path) < ttl:
+        try:
+            with open(path) as fin:
+                return json.load(fin)
+        except (OSError, ValueError):
+            pass # Unreadable cache, fetch again.
+    return None
+
+
+def write_cached_json(path, document):
+    """Store `document` at `path`, replacing the file atomically so that
+    concurrent processes never read a partial write."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as fout:
+            json.dump(document, fout)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass # The cache is an optimization, never fail because of it.
+
+
+def cached_json(path, ttl, fetch):
+    """
+    Return the JSON document stored at `path` if it is younger than `ttl`
+    seconds, otherwise call `fetch()` and store its result there.
+    Args:
+        path: Cache file, None to always fetch.
+        ttl: Maximum age of the cached document in seconds.
+        fetch: Callable returning a JSON-serializable document.
+    """
+    document = read_cached_json(path, ttl)
+    if document is None:
+        document = fetch()
+        if path:
+            write_cached_json(path, document)
+    return document
+
+
+def split_workers(max_workers, tasks):
+    """
+    Share `max_workers` requests in flight between `tasks` tasks that each
+    keep their own requests in flight.
+    Returns:
+        The number of tasks to run at once and the max_workers of each, so
+        that at most `max_workers` requests are in flight in total.
+    """
+    concurrent = max(1, min(tasks, max_workers or 1))
+    return concurrent, max(1, (max_workers or 1) // concurrent)
+
+
+def translate_per_target(translate_sents, texts, srclang, trglangs, max_workers=1):
+    """
+    Translate `texts` into every language of `trglangs` by running
+    `translate_sents(texts, srclang, trglang, max_workers=...)` for the
+    targets concurrently, with at most `max_workers` requests in flight
+    across all of them, see split_workers().
+    Returns:
+        A {trglang: translations} dict.
+    """
+    concurrent, workers = split_workers(max_workers, len(trglangs))
+    translate = lambda trglang: translate_sents(texts, srclang, trglang, max_workers=workers)
+    return dict(zip(trglangs, imap_ordered(translate, trglangs, concurrent)))
+
+
+def translate_detected(translator, texts, trglang, quiet=False, max_workers=None,
+                       normalize_whitespace=False):
+    """translate_sents() of texts in several source languages, see
+    translate_detected_multi()."""
+    return translate_detected_multi(translator, texts, [trglang], quiet=quiet,
+                                    max_workers=max_workers,
+                                    normalize_whitespace=normalize_whitespace)[trglang]
+
+
+# Languages reported for texts a provider could not identify, e.g. Google's
+# 'und' for blank lines and numbers.
+UNDETERMINED = frozenset({'und', '', None})
+
+
+def translate_detected_multi(translator, texts, trglangs, quiet=False, max_workers=None,
+                             normalize_whitespace=False):
+    """
+    translate_sents_multi() of texts in several source languages: detect the
+    language of every text once with `translator.detect_sents()`, translate
+    the texts of each language as one group with
+    `translator.translate_sents_multi()`, the groups concurrently with at most
+    `max_workers` requests in flight across all of them, and restore the
+    input order. Texts already in a target language are kept as they are for
+    that target, texts of an UNDETERMINED language for every target.
+    Returns:
+        A {trglang: translations} dict.
+    """
+    max_workers = max_workers or translator.max_workers
+    languages = translator.detect_sents(texts, quiet=True, max_workers=max_workers)
+    groups = {}
+    for i, language in enumerate(languages):
+        groups.setdefault(language, []).append(i)
+    results = {trglang: list(texts) for trglang in trglangs}
+    sources = [language for language in groups
+               if language not in UNDETERMINED and set(trglangs) - {language}]
+    concurrent, workers = split_workers(max_workers, len(sources))
+    translate = lambda language: translator.translate_sents_multi(
+        [texts[i] for i in groups[language]], language,
+        [trglang for trglang in trglangs if trglang != language], quiet=quiet,
+        max_workers=workers, normalize_whitespace=normalize_whitespace)
+    for language, translations in zip(sources, imap_ordered(translate, sources, concurrent)):
+        for trglang, group in translations.items():
+            for i, translation in zip(groups[language], group):
+                results[trglang][i] = translation
+    return results
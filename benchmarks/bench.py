@@ -0,0 +1,164 @@
+"""
+Throughput benchmarks of aomame against the local mock server.
+
+    python benchmarks/bench.py translate --api microsoft --sizes 100 1000 10000 -w 4
+    python benchmarks/bench.py cli --api google --sizes 1000 10000 --stream -w 4
+    python benchmarks/bench.py asr --sizes 4 16 -w 4 --seconds 30
+
+Every run reports items/sec, the requests and bytes the server received,
+the throttled requests and the p50/p99 server-side request latency.
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aomame import GoogleASR, GoogleTranslator, MicrosoftTranslator, SystranTranslator
+from aomame.ratelimit import RateLimiter
+
+from mock_server import MockServer
+
+TRANSLATORS = {'google': GoogleTranslator, 'microsoft': MicrosoftTranslator,
+               'systran': SystranTranslator}
+
+WORDS = ("the of and to in is was for on that with as by at from his her an were are "
+         "which this be or has had not but first new after who they its also one two "
+         "time year city world people school music team game film river church war "
+         "translation quality request latency provider server client batch").split()
+
+
+def corpus(size, seed=0, duplicates=0.1):
+    """`size` synthetic sentences, a `duplicates` fraction repeating earlier ones."""
+    rng = random.Random(seed)
+    sentences = []
+    for i in range(size):
+        if sentences and rng.random() < duplicates:
+            sentences.append(rng.choice(sentences))
+        else:
+            words = rng.choices(WORDS, k=rng.randint(5, 30))
+            sentences.append(' '.join(words).capitalize() + '.')
+    return sentences
+
+
+def write_silence(path, seconds, sample_rate=16000):
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b'\0\0' * int(seconds * sample_rate))
+
+
+def report(name, size, seconds, stats):
+    throttled = stats['statuses'].get(429, 0)
+    print(f"{name:<24}{size:>8}{seconds:>9.2f}{size / seconds:>12.1f}{stats['requests']:>10}"
+          f"{stats['bytes']:>12}{throttled:>6}{stats['p50'] * 1000:>9.1f}{stats['p99'] * 1000:>9.1f}")
+
+
+def header():
+    print(f"{'benchmark':<24}{'items':>8}{'seconds':>9}{'items/sec':>12}{'requests':>10}"
+          f"{'bytes':>12}{'429s':>6}{'p50 ms':>9}{'p99 ms':>9}")
+
+
+def rate_limiter(args):
+    return RateLimiter(args.requests_per_second, args.chars_per_minute,
+                       args.max_retries, backoff=args.backoff)
+
+
+def bench_translate(server, args):
+    for size in args.sizes:
+        texts = corpus(size)
+        translator = TRANSLATORS[args.api](server.host, 'key', max_workers=args.workers,
+                                           rate_limiter=rate_limiter(args), scheme='http')
+        server.reset_stats()
+        start = time.perf_counter()
+        translator.translate_sents(texts, 'en', 'de', quiet=True)
+        report(f'{args.api} translate_sents', size, time.perf_counter() - start, server.stats())
+
+
+def bench_cli(server, args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in args.sizes:
+            input_file, output_file = os.path.join(tmpdir, 'in.txt'), os.path.join(tmpdir, 'out.txt')
+            with open(input_file, 'w') as fout:
+                fout.write('\n'.join(corpus(size)) + '\n')
+            command = [sys.executable, '-m', 'aomame.bin.translate', '-api', args.api,
+                       '-key', 'key', '--host', server.host, '--scheme', 'http',
+                       '-slang', 'en', '-tlang', 'de', '-i', input_file, '-o', output_file,
+                       '-w', str(args.workers)]
+            if args.stream:
+                command.append('--stream')
+            server.reset_stats()
+            start = time.perf_counter()
+            subprocess.run(command, check=True, stderr=subprocess.DEVNULL,
+                           env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+            report(f'{args.api} cli', size, time.perf_counter() - start, server.stats())
+
+
+def bench_asr(server, args):
+    asr = GoogleASR(server.host, 'key', rate_limiter=rate_limiter(args), scheme='http')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in args.sizes:
+            files = []
+            for i in range(size):
+                files.append(os.path.join(tmpdir, f'{size}-{i}.wav'))
+                write_silence(files[-1], args.seconds)
+            server.reset_stats()
+            start = time.perf_counter()
+            asr.transcribe_many(files, 'en-US', workers=args.workers, quiet=True)
+            report('asr transcribe_many', size, time.perf_counter() - start, server.stats())
+
+        # One long recording of all the files' audio, split into segments.
+        long_file = os.path.join(tmpdir, 'long.wav')
+        write_silence(long_file, args.seconds * max(args.sizes))
+        server.reset_stats()
+        start = time.perf_counter()
+        asr.transcribe_long(long_file, 'en-US', workers=args.workers, quiet=True)
+        stats = server.stats()
+        report('asr transcribe_long', stats['requests'], time.perf_counter() - start, stats)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmark", choices=["translate", "cli", "asr"])
+    parser.add_argument("-api", default="microsoft", choices=sorted(TRANSLATORS))
+    parser.add_argument("--sizes", type=int, nargs='+', default=[100, 1000, 10000],
+                        help="corpus sizes in sentences, or number of audio files for asr")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="requests kept in flight")
+    parser.add_argument("--stream", action="store_true", help="run the cli in --stream mode")
+    parser.add_argument("--seconds", type=float, default=30, help="length of every audio file")
+    # Mock server.
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="upper bound of the random extra delay")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests throttled")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After of throttled requests")
+    parser.add_argument("--max-items", type=int, default=None, help="override the items per request limit")
+    parser.add_argument("--max-chars", type=int, default=None, help="override the characters per request limit")
+    # Client.
+    parser.add_argument("--requests-per-second", type=float, default=None)
+    parser.add_argument("--chars-per-minute", type=float, default=None)
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--backoff", type=float, default=1, help="initial retry backoff in seconds")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    limit = {k: v for k, v in (('max_items', args.max_items), ('max_chars', args.max_chars))
+             if v is not None}
+    limits = {args.api: limit} if limit else None
+    benchmark = {'translate': bench_translate, 'cli': bench_cli, 'asr': bench_asr}[args.benchmark]
+    with MockServer(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                    retry_after=args.retry_after, limits=limits, seed=0) as server:
+        header()
+        benchmark(server, args)
+
+
+if __name__ == '__main__':
+    main()
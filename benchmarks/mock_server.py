@@ -0,0 +1,293 @@
+"""
+Local HTTP server emulating the provider endpoints used by the aomame
+clients, for benchmarks that must not spend real API quota.
+
+Point a client at it with the `host` and `scheme` constructor arguments:
+
+    server = MockServer(latency=0.05, jitter=0.02, rate_429=0.01).start()
+    translator = MicrosoftTranslator(server.host, 'key', scheme='http')
+
+Or run it on its own with `python benchmarks/mock_server.py --port 8080`.
+
+Translations are the source text prefixed with `[trglang] `, transcripts
+report the number of audio bytes received. Language detection reads such a
+prefix back and takes any other text for English, except that Google reports
+text without letters as undetermined ('und') and rejects it as a source
+language, like the real API.
+"""
+
+import argparse
+import base64
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Per-request limits of the real endpoints, see aomame/batching.py.
+DEFAULT_LIMITS = {
+    'microsoft': {'max_items': 1000, 'max_chars': 50000},
+    'google': {'max_items': 128, 'max_chars': 30000},
+    'systran': {'max_items': 50, 'max_chars': None},
+    # Synchronous recognize takes about a minute of audio, 10MB of request.
+    'google_asr': {'max_items': 1, 'max_chars': 10 * 1024 * 1024},
+}
+
+LANGUAGES = ['de', 'en', 'es', 'fr', 'ja', 'zh-Hans']
+
+
+def percentile(values, q):
+    """Nearest-rank percentile `q` (0-100) of `values`."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def translated(text, trglang):
+    return f'[{trglang}] {text}'
+
+
+def detected(text):
+    if text.startswith('[') and '] ' in text:
+        return text[1:text.index('] ')]
+    return 'en'
+
+
+class BadRequest(Exception):
+    pass
+
+
+class LimitExceeded(BadRequest):
+    pass
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        start = time.perf_counter()
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        # Microsoft's endpoints are requested as //translate, don't let the
+        # empty segment read as a host.
+        path, _, query = self.path.partition('?')
+        path, params = path.strip('/'), parse_qs(query, keep_blank_values=True)
+        server = self.server
+
+        server.delay()
+        if server.throttle():
+            status, payload = 429, {'error': {'code': 429, 'message': 'Too many requests'}}
+        else:
+            try:
+                status, payload = 200, server.route(method, path, params, body)
+            except BadRequest as e:
+                status, payload = 400, {'error': {'code': 400, 'message': str(e)}}
+            except KeyError as e:
+                status, payload = 404, {'error': {'code': 404, 'message': f'Unknown endpoint {e}'}}
+
+        content = json.dumps(payload).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        if status == 429 and server.retry_after is not None:
+            self.send_header('Retry-After', str(server.retry_after))
+        self.end_headers()
+        self.wfile.write(content)
+        server.record(status, len(self.path) + len(body), time.perf_counter() - start)
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    Threaded mock of the Microsoft, Google, Systran and Google ASR endpoints.
+    Args:
+        host: Interface to listen on.
+        port: Port to listen on, 0 for any free port.
+        latency: Seconds added to every response.
+        jitter: Upper bound of a uniformly random extra delay in seconds.
+        rate_429: Fraction of requests answered with 429 Too Many Requests.
+        retry_after: Retry-After header of the 429 responses, None to omit it.
+        limits: {provider: {'max_items': n, 'max_chars': n}} overriding
+            DEFAULT_LIMITS, requests over a limit get a 400.
+        seed: Seed of the latency and 429 randomness.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, rate_429=0.0,
+                 retry_after=None, limits=None, seed=None):
+        super().__init__((host, port), MockHandler)
+        self.latency, self.jitter = latency, jitter
+        self.rate_429, self.retry_after = rate_429, retry_after
+        self.limits = {provider: dict(limit) for provider, limit in DEFAULT_LIMITS.items()}
+        for provider, limit in (limits or {}).items():
+            self.limits[provider].update(limit)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.reset_stats()
+
+    @property
+    def host(self):
+        """The `host` argument for a client talking to this server."""
+        return f'{self.server_address[0]}:{self.server_address[1]}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def delay(self):
+        with self._lock:
+            seconds = self.latency + self._random.uniform(0, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def throttle(self):
+        with self._lock:
+            return self._random.random() < self.rate_429
+
+    def record(self, status, nbytes, seconds):
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += nbytes
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.latencies.append(seconds)
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests, self.bytes_received = 0, 0
+            self.statuses, self.latencies = {}, []
+
+    def stats(self):
+        """Request count, bytes received, status counts and latency percentiles."""
+        with self._lock:
+            return {'requests': self.requests, 'bytes': self.bytes_received,
+                    'statuses': dict(self.statuses),
+                    'p50': percentile(self.latencies, 50),
+                    'p99': percentile(self.latencies, 99)}
+
+    def check(self, provider, items, chars):
+        limit = self.limits[provider]
+        if items > limit['max_items']:
+            raise LimitExceeded(f'{items} items over the limit of {limit["max_items"]}')
+        if limit['max_chars'] is not None and chars > limit['max_chars']:
+            raise LimitExceeded(f'{chars} characters over the limit of {limit["max_chars"]}')
+
+    def route(self, method, path, params, body):
+        routes = {
+            # Microsoft
+            'translate': self.microsoft_translate,
+            'transliterate': self.microsoft_transliterate,
+            'breaksentence': self.microsoft_breaksentence,
+            'languages': self.microsoft_languages,
+            'detect': self.microsoft_detect,
+            # Google
+            'language/translate/v2': self.google_translate,
+            'language/translate/v2/languages': self.google_languages,
+            'language/translate/v2/detect': self.google_detect,
+            # Systran
+            'translation/text/translate': self.systran_translate,
+            'nlp/lid/detectLanguage/document': self.systran_langid,
+            # Google ASR
+            'v1/speech:recognize': self.google_recognize,
+        }
+        return routes[path](params, json.loads(body) if body else None)
+
+    def microsoft_translate(self, params, body):
+        texts = [item['Text'] for item in body]
+        self.check('microsoft', len(texts), sum(map(len, texts)) * len(params['to']))
+        return [{'translations': [{'text': translated(t, trglang), 'to': trglang}
+                                  for trglang in params['to']]} for t in texts]
+
+    def microsoft_transliterate(self, params, body):
+        self.check('microsoft', len(body), sum(len(item['Text']) for item in body))
+        return [{'text': item['Text'], 'script': params['toScript'][0]} for item in body]
+
+    def microsoft_breaksentence(self, params, body):
+        self.check('microsoft', len(body), sum(len(item['Text']) for item in body))
+        # One sentence per line.
+        return [{'sentLen': [len(line) for line in item['Text'].splitlines(keepends=True)]}
+                for item in body]
+
+    def microsoft_languages(self, params, body):
+        return {'translation': {lang: {'name': lang} for lang in LANGUAGES},
+                'transliteration': {}}
+
+    def microsoft_detect(self, params, body):
+        self.check('microsoft', len(body), sum(len(item['Text']) for item in body))
+        return [{'language': detected(item['Text']), 'score': 1.0} for item in body]
+
+    def google_translate(self, params, body):
+        texts = body['q'] if isinstance(body['q'], list) else [body['q']]
+        self.check('google', len(texts), sum(map(len, texts)))
+        if body.get('source') == 'und':
+            raise BadRequest('Invalid Value')
+        return {'data': {'translations': [{'translatedText': translated(t, body['target'])}
+                                          for t in texts]}}
+
+    def google_languages(self, params, body):
+        return {'data': {'languages': [{'language': lang} for lang in LANGUAGES]}}
+
+    def google_detect(self, params, body):
+        texts = body['q'] if isinstance(body['q'], list) else [body['q']]
+        self.check('google', len(texts), sum(map(len, texts)))
+        detect = lambda text: detected(text) if any(c.isalpha() for c in text) else 'und'
+        return {'data': {'detections': [[{'language': detect(t), 'confidence': 1.0,
+                                          'isReliable': False}] for t in texts]}}
+
+    def systran_translate(self, params, body):
+        texts = params['input']
+        self.check('systran', len(texts), sum(map(len, texts)))
+        return {'outputs': [{'output': translated(t, params['target'][0])} for t in texts]}
+
+    def systran_langid(self, params, body):
+        return {'detectedLanguages': [{'lang': detected(params['input'][0]), 'confidence': 1.0}]}
+
+    def google_recognize(self, params, body):
+        content = body['audio']['content']
+        self.check('google_asr', 1, len(content))
+        nbytes = len(base64.b64decode(content))
+        return {'results': [{'alternatives': [{'transcript': f'{nbytes} bytes'}]}]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="upper bound of the random extra delay")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests throttled")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After of throttled requests")
+    args = parser.parse_args()
+    server = MockServer(args.host, args.port, args.latency, args.jitter, args.rate_429,
+                        args.retry_after)
+    print(f"Serving on http://{server.host}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats()), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,7 +16,9 @@ setup(
     "License :: OSI Approved :: MIT License",
     "Operating System :: OS Independent",
   ],
+  python_requires = '>=3.9',
   install_requires = ['requests', 'tqdm'],
+  extras_require = {'async': ['aiohttp']},
   entry_points={
     "console_scripts": [
         "aomame-translate=aomame.bin.translate:main",
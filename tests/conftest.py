@@ -0,0 +1,68 @@
+import json
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from aomame import MicrosoftTranslator, SystranTranslator
+
+
+class FakeResponse:
+    """requests.Response with a JSON payload."""
+    def __init__(self, status_code, payload, headers=None):
+        self.status_code, self.headers = status_code, headers or {}
+        self.content = json.dumps(payload).encode('utf8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeSystranSession:
+    """Answers batches of Systran translate requests with `batch_status`,
+    single texts with a translation."""
+    def __init__(self, batch_status=200):
+        self.batch_status, self.requests = batch_status, []
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        inputs = params['input'] if isinstance(params['input'], list) else [params['input']]
+        self.requests.append(inputs)
+        if len(inputs) > 1 and self.batch_status != 200:
+            return FakeResponse(self.batch_status, {'error': {'message': 'Failed'}})
+        return FakeResponse(200, {'outputs': [{'output': f"{params['target']}:{text.upper()}"}
+                                              for text in inputs]})
+
+
+class FakeMicrosoftSession:
+    """Answers Microsoft translate requests for every `to` target."""
+    def __init__(self):
+        self.requests = []
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        texts = [item['Text'] for item in json]
+        self.requests.append(texts)
+        trglangs = parse_qs(urlsplit(url).query)['to']
+        return FakeResponse(200, [{'translations': [{'text': f'{trglang}:{text.upper()}'}
+                                                    for trglang in trglangs]} for text in texts])
+
+
+@pytest.fixture
+def make_response():
+    """FakeResponse factory, `make_response(status_code, payload, headers)`."""
+    return FakeResponse
+
+
+@pytest.fixture
+def make_systran():
+    """SystranTranslator factory answering from a FakeSystranSession(batch_status)."""
+    def make(batch_status=200, **kwargs):
+        return SystranTranslator('localhost', 'key', session=FakeSystranSession(batch_status),
+                                 max_retries=0, **kwargs)
+    return make
+
+
+@pytest.fixture
+def make_microsoft():
+    """MicrosoftTranslator factory answering from a FakeMicrosoftSession."""
+    def make(**kwargs):
+        return MicrosoftTranslator('localhost', 'key', session=FakeMicrosoftSession(),
+                                   max_retries=0, metadata_dir=None, **kwargs)
+    return make
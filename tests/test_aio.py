@@ -0,0 +1,211 @@
+import asyncio
+import base64
+import inspect
+import threading
+import wave
+from json import dumps, loads
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+import aomame.aio
+from aomame import Metrics, TranslationCache
+from aomame.aio import (AsyncGoogleASR, AsyncGoogleTranslator, AsyncMicrosoftTranslator,
+                        AsyncSystranTranslator)
+
+
+class FakeResponse:
+    def __init__(self, url, payload, status=200):
+        self.url, self.status, self.headers = url, status, {}
+        self._content = dumps(payload).encode('utf8')
+
+    async def read(self):
+        return self._content
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeSession:
+    """aiohttp.ClientSession answering the Google and Microsoft translate
+    and detect endpoints and Google recognize like benchmarks/mock_server.py."""
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, headers=None, json=None, params=None, data=None):
+        path, _, query = url.partition('?')
+        endpoint = path.rsplit('/', 1)[-1]
+        self.requests.append((endpoint, json if data is None else loads(data)))
+        if endpoint == 'speech:recognize':
+            audio = base64.b64decode(loads(data)['audio']['content'])
+            payload = {'results': [{'alternatives': [{'transcript': f'{len(audio)} bytes'}]}]}
+        elif endpoint == 'languages' and 'translate/v2' in path:
+            payload = {'data': {'languages': [{'language': 'de'}]}}
+        elif endpoint == 'languages':
+            payload = {'translation': {'de': {'name': 'German'}}, 'transliteration': {}}
+        elif isinstance(json, list) and endpoint == 'detect':
+            payload = [{'language': detected(item['Text'])} for item in json]
+        elif isinstance(json, list):
+            # Microsoft
+            trglangs = [p[3:] for p in query.split('&') if p.startswith('to=')]
+            payload = [{'translations': [{'text': f"[{trglang}] {item['Text']}"}
+                                         for trglang in trglangs]} for item in json]
+        elif endpoint == 'detect':
+            # Google can't tell the language of text without letters.
+            payload = {'data': {'detections': [
+                [{'language': detected(t) if any(c.isalpha() for c in t) else 'und'}]
+                for t in json['q']]}}
+        elif json['source'] == 'und':
+            return FakeResponse(url, {'error': {'code': 400, 'message': 'Invalid Value'}}, 400)
+        else:
+            payload = {'data': {'translations': [{'translatedText': f"[{json['target']}] {t}"}
+                                                 for t in json['q']]}}
+        return FakeResponse(url, payload)
+
+    async def close(self):
+        pass
+
+
+def detected(text):
+    return text[1:text.index('] ')] if text.startswith('[') else 'en'
+
+
+class ThreadCheckingCache(TranslationCache):
+    """Fails any access from the thread running the event loop."""
+    def get_many(self, *args):
+        assert threading.current_thread() is not threading.main_thread()
+        return super().get_many(*args)
+
+    def set_many(self, *args):
+        assert threading.current_thread() is not threading.main_thread()
+        return super().set_many(*args)
+
+
+def google(**kwargs):
+    return AsyncGoogleTranslator('localhost', 'key', session=FakeSession(), metadata_dir=None,
+                                 **kwargs)
+
+
+def microsoft(**kwargs):
+    return AsyncMicrosoftTranslator('localhost', 'key', session=FakeSession(), metadata_dir=None,
+                                    **kwargs)
+
+
+def test_cache_runs_off_the_event_loop():
+    async def run():
+        gt = google(cache=ThreadCheckingCache())
+        texts = ['a', 'b', 'a']
+        assert await gt.translate_sents(texts, 'en', 'de') == ['[de] a', '[de] b', '[de] a']
+        assert await gt.translate_sents(texts, 'en', 'de') == ['[de] a', '[de] b', '[de] a']
+        assert len(gt.session.requests) == 1
+        assert await gt.translate('c', 'en', 'de') == '[de] c'
+        assert await gt.translate('c', 'en', 'de') == '[de] c'
+        assert len(gt.session.requests) == 2
+    asyncio.run(run())
+
+
+def test_metadata_file_runs_off_the_event_loop(tmp_path, monkeypatch):
+    for name in 'read_cached_json', 'write_cached_json':
+        def off_the_loop(*args, _function=getattr(aomame.aio, name)):
+            assert threading.current_thread() is not threading.main_thread()
+            return _function(*args)
+        monkeypatch.setattr(aomame.aio, name, off_the_loop)
+
+    async def run(metadata_dir):
+        gt = AsyncGoogleTranslator('localhost', 'key', session=FakeSession(),
+                                   metadata_dir=metadata_dir)
+        mt = AsyncMicrosoftTranslator('localhost', 'key', session=FakeSession(),
+                                      metadata_dir=metadata_dir)
+        assert await gt.languages() == {'de'}
+        assert await mt.languages() == {'de': 'German'}
+        return len(gt.session.requests) + len(mt.session.requests)
+    assert asyncio.run(run(str(tmp_path))) == 2
+    # Read back from the files.
+    assert asyncio.run(run(str(tmp_path))) == 0
+
+
+def test_payload_only_measured_with_metrics(monkeypatch):
+    # The batch planner sizes the texts with json.dumps() too, only count payloads.
+    dumped = []
+    monkeypatch.setattr('aomame.aio.json.dumps',
+                        lambda obj: (isinstance(obj, dict) and dumped.append(obj)) or dumps(obj))
+
+    async def run(translator):
+        assert await translator.translate_sents(['a', 'b'], 'en', 'de') == ['[de] a', '[de] b']
+    asyncio.run(run(google()))
+    assert dumped == []
+    metrics = Metrics()
+    asyncio.run(run(google(metrics=metrics)))
+    assert len(dumped) == 1
+
+
+@pytest.mark.parametrize('make_translator', [google, microsoft])
+def test_translate_sents_multi(make_translator):
+    async def run():
+        translator = make_translator(cache=TranslationCache())
+        texts = ['a', 'b', 'a']
+        expected = {trglang: [f'[{trglang}] {t}' for t in texts] for trglang in ('de', 'fr')}
+        assert await translator.translate_sents_multi(texts, 'en', ['de', 'fr']) == expected
+        assert await translator.translate_sents_multi(texts, 'en', ['de', 'fr']) == expected
+        return translator.session.requests
+    requests = asyncio.run(run())
+    # Microsoft sends both targets in one request.
+    assert len(requests) == (2 if make_translator is google else 1)
+
+
+@pytest.mark.parametrize('make_translator', [google, microsoft])
+def test_auto_source_language(make_translator):
+    async def run():
+        translator = make_translator(cache=TranslationCache())
+        texts = ['hello', '[fr] bonjour', '[de] hallo', 'hello']
+        assert await translator.detect_sents(texts) == ['en', 'fr', 'de', 'en']
+        assert await translator.detect('[ja] x') == 'ja'
+        assert await translator.translate_sents_multi(texts, 'auto', ['de', 'fr']) == {
+            'de': ['[de] hello', '[de] [fr] bonjour', '[de] hallo', '[de] hello'],
+            'fr': ['[fr] hello', '[fr] bonjour', '[fr] [de] hallo', '[fr] hello']}
+        assert await translator.translate('[fr] x', 'auto', 'en') == '[en] [fr] x'
+        return [endpoint for endpoint, _ in translator.session.requests]
+    # Detections are cached, translating the texts doesn't detect them again.
+    assert asyncio.run(run()).count('detect') == 3
+
+
+def test_auto_source_language_keeps_undetermined():
+    async def run():
+        translator = google()
+        return await translator.translate_sents(['hello', '42', ''], 'auto', 'de')
+    assert asyncio.run(run()) == ['[de] hello', '42', '']
+
+
+def test_asr_many_and_long(tmp_path):
+    for i, seconds in enumerate([1, 2]):
+        with wave.open(str(tmp_path / f'{i}.wav'), 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(8000)
+            wav.writeframes(b'\0\0' * 8000 * seconds)
+
+    async def run():
+        asr = AsyncGoogleASR('localhost', 'key', session=FakeSession())
+        many = await asr.transcribe_many(str(tmp_path), 'en-US')
+        long = await asr.transcribe_long(str(tmp_path / '1.wav'), 'en-US', segment_seconds=1)
+        return many, long, [body['config'] for _, body in asr.session.requests]
+    many, long, configs = asyncio.run(run())
+    # Whole files are sent with their header, segments as raw frames.
+    assert many == ['16044 bytes', '32044 bytes']
+    assert long == '16000 bytes 16000 bytes'
+    assert len(configs) == 4
+    # The channel count is only given for the headerless segments.
+    assert ['audioChannelCount' in config for config in configs] == [False, False, True, True]
+    assert configs[-1]['sampleRateHertz'] == 8000
+
+
+@pytest.mark.parametrize('cls', [AsyncGoogleASR, AsyncGoogleTranslator, AsyncMicrosoftTranslator,
+                                 AsyncSystranTranslator])
+def test_public_methods_are_async(cls):
+    for name, method in inspect.getmembers(cls, callable):
+        if not name.startswith('_'):
+            assert inspect.iscoroutinefunction(method), name
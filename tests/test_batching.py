@@ -0,0 +1,75 @@
+import random
+
+import pytest
+
+from aomame.batching import (GOOGLE_LIMITS, MICROSOFT_LIMITS, SYSTRAN_LIMITS, BatchLimits,
+                             plan_batches, translate_batches)
+from aomame.exceptions import ResponseError
+from aomame.segment import segment_text
+
+
+def random_texts(n, seed=0):
+    rng = random.Random(seed)
+    return [''.join(rng.choice('abcé語 ') for _ in range(rng.randint(0, 400))) for _ in range(n)]
+
+
+@pytest.mark.parametrize('limits', [GOOGLE_LIMITS, MICROSOFT_LIMITS, SYSTRAN_LIMITS,
+                                    BatchLimits(max_items=3, max_chars=500)])
+def test_plan_batches_covers_texts_within_limits(limits):
+    texts = random_texts(2000) + ['x' * 60000]
+    batches, oversized = plan_batches(texts, limits)
+    indices = sorted(i for batch in batches for i in batch) + oversized
+    assert sorted(indices) == list(range(len(texts)))
+    for batch in batches:
+        assert batch == sorted(batch)
+        assert limits.fits(len(batch), sum(len(texts[i]) for i in batch),
+                           sum(limits.size(texts[i]) + limits.item_overhead for i in batch))
+    for i in oversized:
+        assert not limits.fits_text(texts[i])
+    assert [batch[0] for batch in batches] == sorted(batch[0] for batch in batches)
+
+
+def test_plan_batches_packs_tightly():
+    texts = random_texts(5000)
+    limits = BatchLimits(max_items=100, max_chars=5000)
+    batches, _ = plan_batches(texts, limits)
+    needed = max(sum(map(len, texts)) / limits.max_chars, len(texts) / limits.max_items)
+    assert len(batches) <= 1.1 * needed + 1
+
+
+def test_plan_batches_packs_tightly_by_bytes():
+    # Systran only limits encoded bytes, where a CJK character takes nine.
+    rng = random.Random(0)
+    texts = [rng.choice('a語') * rng.randint(20, 200) for _ in range(2000)]
+    batches, _ = plan_batches(texts, SYSTRAN_LIMITS)
+    nbytes = sum(SYSTRAN_LIMITS.size(t) + SYSTRAN_LIMITS.item_overhead for t in texts)
+    assert len(batches) <= 1.03 * nbytes / SYSTRAN_LIMITS.max_bytes + 1
+
+
+def test_translate_batches_restores_order():
+    texts = [f'text {i}' * (i % 7 + 1) for i in range(100)]
+    limits = BatchLimits(max_items=8, max_chars=120)
+    translations = translate_batches(texts, limits, lambda batch: [t.upper() for t in batch],
+                                     lambda text: text.upper(), max_workers=4, quiet=True)
+    assert translations == [t.upper() for t in texts]
+
+
+def test_translate_batches_short_response():
+    texts = ['a', 'b', 'c']
+    with pytest.raises(ResponseError):
+        translate_batches(texts, BatchLimits(max_items=10), lambda batch: batch[:-1],
+                          lambda text: text, quiet=True)
+
+
+@pytest.mark.parametrize('limits', [GOOGLE_LIMITS, MICROSOFT_LIMITS, SYSTRAN_LIMITS])
+def test_max_segment_chars_fits(limits):
+    for char in 'a', 'é', '語', '😀':
+        assert limits.fits_text(char * limits.max_segment_chars())
+
+
+def test_translate_batches_splits_oversized():
+    texts = ['Short one.', 'First sentence. Second sentence. Third sentence.']
+    limits = BatchLimits(max_items=10, max_chars=20)
+    translations = translate_batches(texts, limits, lambda batch: [t.upper() for t in batch],
+                                     quiet=True, split_oversized=lambda text: segment_text(text, 20))
+    assert translations == [t.upper() for t in texts]
@@ -0,0 +1,76 @@
+import pytest
+
+from aomame.cache import TranslationCache, cached_translate_sents
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Settable time.time() of aomame.cache."""
+    now = [1000.0]
+    monkeypatch.setattr('aomame.cache.time.time', lambda: now[0])
+    return now
+
+
+def test_memory_tier_is_lru():
+    cache = TranslationCache(maxsize=2)
+    cache.set_many('p', 'en', 'de', ['a', 'b'], ['A', 'B'])
+    assert cache.get('p', 'en', 'de', 'a') == 'A'
+    # 'b' is now the least recently used entry.
+    cache.set('p', 'en', 'de', 'c', 'C')
+    assert cache.get_many('p', 'en', 'de', ['a', 'b', 'c']) == {'a': 'A', 'c': 'C'}
+    assert cache.get('p', 'en', 'fr', 'a') is None
+
+
+def test_hit_and_miss_counts():
+    cache = TranslationCache()
+    cache.set_many('p', 'en', 'de', ['a'], ['A'])
+    cache.get_many('p', 'en', 'de', ['a', 'b', 'a'])
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'hit_rate': 2 / 3, 'memory_entries': 1}
+
+
+def test_disk_tier_persists(tmp_path):
+    path = str(tmp_path / 'tm.db')
+    cache = TranslationCache(path=path)
+    cache.set_many('p', 'en', 'de', ['a', 'b'], ['A', 'B'])
+    cache.close()
+    cache = TranslationCache(maxsize=1, path=path)
+    assert cache.get_many('p', 'en', 'de', ['a', 'b', 'c']) == {'a': 'A', 'b': 'B'}
+    assert cache.stats()['memory_entries'] == 1
+
+
+@pytest.mark.parametrize('on_disk', [False, True])
+def test_ttl_expires_entries(tmp_path, clock, on_disk):
+    path = str(tmp_path / 'tm.db') if on_disk else None
+    cache = TranslationCache(path=path, ttl=10)
+    cache.set('p', 'en', 'de', 'a', 'A')
+    clock[0] += 5
+    cache.set('p', 'en', 'de', 'b', 'B')
+    clock[0] += 6
+    if on_disk:
+        # Only the disk tier is left to answer.
+        cache = TranslationCache(path=path, ttl=10)
+    assert cache.get_many('p', 'en', 'de', ['a', 'b']) == {'b': 'B'}
+    if on_disk:
+        cache.set('p', 'en', 'de', 'c', 'C')
+        assert cache._db.execute("SELECT text FROM tm ORDER BY text").fetchall() == [('b',), ('c',)]
+
+
+def test_disk_limit_drops_oldest_rows(tmp_path, clock):
+    cache = TranslationCache(maxsize=1, path=str(tmp_path / 'tm.db'), max_disk_entries=100)
+    for i in range(15):
+        clock[0] += 1
+        cache.set_many('p', 'en', 'de', [f'{i}-{j}' for j in range(10)], ['x'] * 10)
+        rows = cache._db.execute("SELECT COUNT(*) FROM tm").fetchone()[0]
+        assert rows <= 100
+    # Every write going over 100 rows evicts the oldest down to 90.
+    assert rows == 90
+    texts = [f'{i}-{j}' for i in range(15) for j in range(10)]
+    assert sorted(cache.get_many('p', 'en', 'de', texts)) == sorted(texts[-90:])
+
+
+def test_cached_translate_sents_sends_misses_only():
+    cache, sent = TranslationCache(), []
+    translate = lambda texts: sent.append(list(texts)) or [t.upper() for t in texts]
+    assert cached_translate_sents(cache, 'p', ['a', 'b'], 'en', 'de', translate) == ['A', 'B']
+    assert cached_translate_sents(cache, 'p', ['b', 'c'], 'en', 'de', translate) == ['B', 'C']
+    assert sent == [['a', 'b'], ['c']]
@@ -0,0 +1,64 @@
+import argparse
+
+import pytest
+
+from aomame.bin.translate import Checkpoint, output_paths, resume_translate
+
+
+class UpperTranslator:
+    """Translates by upper-casing, failing on the `fail_at`-th call."""
+    def __init__(self, fail_at=None):
+        self.calls, self.fail_at = 0, fail_at
+
+    def translate_sents(self, texts, srclang, trglang, quiet=False):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise RuntimeError('Interrupted')
+        return [f'{trglang}:{text.upper()}' for text in texts]
+
+    def translate_sents_multi(self, texts, srclang, trglangs, quiet=False):
+        return {trglang: self.translate_sents(texts, srclang, trglang) for trglang in trglangs}
+
+
+def run(tmp_path, translator, tlangs, output_file, resume=False, interval=0):
+    args = argparse.Namespace(input_file=str(tmp_path / 'in.txt'), output_file=output_file,
+                              slang='en', tlang=tlangs, checkpoint=None, resume=resume,
+                              batch_size=7, workers=1, checkpoint_interval=interval)
+    resume_translate(translator, args)
+
+
+@pytest.mark.parametrize('interval', [0, 3600])
+@pytest.mark.parametrize('tlangs', [['de'], ['de', 'fr']])
+def test_resume_matches_uninterrupted_run(tmp_path, tlangs, interval):
+    lines = [f'line {i} é' for i in range(100)]
+    (tmp_path / 'in.txt').write_text('\n'.join(lines) + '\n', encoding='utf8')
+
+    full, resumed = str(tmp_path / 'full.{tlang}'), str(tmp_path / 'resumed.{tlang}')
+    run(tmp_path, UpperTranslator(), tlangs, full)
+    # Interrupted during the sixth batch.
+    with pytest.raises(RuntimeError):
+        run(tmp_path, UpperTranslator(fail_at=len(tlangs) * 5 + 1), tlangs, resumed,
+            interval=interval)
+    # The batches written before the failure are checkpointed, even between intervals.
+    assert Checkpoint(resumed + '.ckpt').load()['lines'] == 5 * 7
+    # Output written after the checkpoint, e.g. by a crash mid-batch, is dropped.
+    for path in output_paths(resumed, tlangs):
+        with open(path, 'ab') as fout:
+            fout.write(b'partial')
+    run(tmp_path, UpperTranslator(), tlangs, resumed, resume=True)
+
+    for expected, path in zip(output_paths(full, tlangs), output_paths(resumed, tlangs)):
+        with open(expected, 'rb') as fexpected, open(path, 'rb') as fresumed:
+            assert fresumed.read() == fexpected.read()
+    with open(output_paths(full, tlangs)[0], encoding='utf8') as fin:
+        assert fin.read().splitlines()[3] == f'{tlangs[0]}:LINE 3 É'
+
+
+def test_checkpoint_interval_limits_fsyncs(tmp_path, monkeypatch):
+    (tmp_path / 'in.txt').write_text(''.join(f'line {i}\n' for i in range(100)), encoding='utf8')
+    fsyncs = []
+    monkeypatch.setattr('aomame.bin.translate.os.fsync', fsyncs.append)
+    run(tmp_path, UpperTranslator(), ['de', 'fr'], str(tmp_path / 'out.{tlang}'), interval=3600)
+    # Saved after the first batch and at the end, each syncing two outputs and the checkpoint.
+    assert len(fsyncs) == 2 * 3
+    assert Checkpoint(str(tmp_path / 'out.{tlang}') + '.ckpt').load()['lines'] == 100
@@ -0,0 +1,27 @@
+from aomame import Metrics
+
+
+def counter(metrics, name, **labels):
+    return metrics.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+def test_deduplicated_chars_are_counted(make_systran):
+    events = []
+    metrics = Metrics(callbacks=[lambda event, fields: events.append((event, fields))])
+    systran = make_systran(metrics=metrics)
+    texts = ['hello', 'world', 'hello', 'hello']
+    assert systran.translate_sents(texts, 'en', 'de', quiet=True) == [f'de:{t.upper()}' for t in texts]
+    assert systran.session.requests == [['hello', 'world']]
+    assert counter(metrics, 'aomame_chars_deduplicated_total', provider='systran') == 10
+    assert counter(metrics, 'aomame_chars_billed_total', provider='systran') == 10
+    assert '10 deduplicated' in metrics.summary()
+    assert ('deduplicated', {'provider': 'systran', 'chars': 10}) in events
+
+
+def test_deduplicated_chars_are_counted_per_target(make_systran, make_microsoft):
+    texts = ['hello', 'world', 'hello']
+    for translator in make_systran(metrics=Metrics()), make_microsoft(metrics=Metrics()):
+        translations = translator.translate_sents_multi(texts, 'en', ['de', 'fr'], quiet=True)
+        assert translations['fr'] == [f'fr:{t.upper()}' for t in texts]
+        assert counter(translator.metrics, 'aomame_chars_deduplicated_total',
+                       provider=translator.provider) == 10
@@ -0,0 +1,96 @@
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+
+from aomame.ratelimit import RETRYABLE_STATUS, RateLimiter, retry_after
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Seconds slept by aomame.ratelimit, without sleeping."""
+    slept = []
+    monkeypatch.setattr('aomame.ratelimit.time.sleep', slept.append)
+    return slept
+
+
+def sender(*outcomes):
+    """send() returning or raising `outcomes` in turn, recording its calls."""
+    outcomes, calls = list(outcomes), []
+
+    def send():
+        calls.append(len(calls))
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return send, calls
+
+
+def test_retry_after_seconds_and_date(make_response):
+    assert retry_after(make_response(429, {}, {'Retry-After': '3'})) == 3.0
+    assert retry_after(make_response(429, {}, {'Retry-After': '-1'})) == 0.0
+    date = formatdate(time.time() + 30, usegmt=True)
+    assert 28 <= retry_after(make_response(503, {}, {'Retry-After': date})) <= 30
+    assert retry_after(make_response(503, {})) is None
+    assert retry_after(make_response(503, {}, {'Retry-After': 'soon'})) is None
+
+
+def test_retry_after_is_honoured(make_response, sleeps):
+    retries = []
+    send, calls = sender(make_response(503, {}, {'Retry-After': '3'}), make_response(200, {}))
+    limiter = RateLimiter(backoff=0.5)
+    response = limiter.call(send, on_retry=lambda status, delay: retries.append((status, delay)))
+    assert response.status_code == 200 and len(calls) == 2
+    assert [status for status, _ in retries] == [503]
+    assert 3 <= retries[0][1] <= 3.5 and sleeps == [retries[0][1]]
+
+
+@pytest.mark.parametrize('status', sorted(RETRYABLE_STATUS))
+def test_retryable_status_is_retried(make_response, sleeps, status):
+    send, calls = sender(make_response(status, {}), make_response(200, {}))
+    assert RateLimiter().call(send).status_code == 200
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize('status', [200, 400, 401, 403, 404, 413])
+def test_other_status_is_returned(make_response, sleeps, status):
+    send, calls = sender(make_response(status, {}))
+    assert RateLimiter().call(send).status_code == status
+    assert len(calls) == 1 and sleeps == []
+
+
+def test_last_response_after_max_retries(make_response, sleeps):
+    responses = [make_response(500, {'attempt': i}) for i in range(3)]
+    send, calls = sender(*responses)
+    retries = []
+    response = RateLimiter(max_retries=2).call(send, on_retry=lambda *args: retries.append(args))
+    assert response is responses[-1]
+    assert len(calls) == 3 and len(retries) == 2
+
+
+def test_connection_errors_are_retried(make_response, sleeps):
+    send, calls = sender(requests.ConnectionError(), requests.Timeout(), make_response(200, {}))
+    retries = []
+    response = RateLimiter().call(send, on_retry=lambda status, delay: retries.append(status))
+    assert response.status_code == 200 and retries == [None, None]
+
+
+def test_connection_errors_are_reraised(sleeps):
+    send, calls = sender(*[requests.ConnectionError()] * 3)
+    with pytest.raises(requests.ConnectionError):
+        RateLimiter(max_retries=2).call(send)
+    assert len(calls) == 3
+
+
+def test_429_pauses_every_caller(make_response, sleeps):
+    limiter = RateLimiter(backoff=0.1)
+    assert limiter.reserve() == 0
+    # A 503 only delays its own retry.
+    limiter.call(sender(make_response(503, {}, {'Retry-After': '5'}), make_response(200, {}))[0])
+    assert limiter.reserve() == 0
+    limiter.call(sender(make_response(429, {}, {'Retry-After': '5'}), make_response(200, {}))[0])
+    # The sleeps were skipped, so the pause is still on for other callers.
+    assert 4 <= limiter.reserve() <= 5.1
+    assert 4 <= limiter.estimate_wait() <= 5.1
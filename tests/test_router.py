@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from aomame import RateLimiter, RouterTranslator
+from aomame.exceptions import ResponseError
+
+
+class FakeTranslator:
+    """Translates by prefixing its name, after `delay` seconds, failing
+    while `fail` is set."""
+    def __init__(self, provider, delay=0, fail=False):
+        self.provider, self.delay, self.fail = provider, delay, fail
+        self.rate_limiter = RateLimiter()
+        self.chunks = []
+        self._lock = threading.Lock()
+
+    def translate_sents(self, texts, srclang, trglang, quiet=False, max_workers=None):
+        time.sleep(self.delay)
+        if self.fail:
+            raise ResponseError(f'{self.provider} is down')
+        with self._lock:
+            self.chunks.append(list(texts))
+        return [f'{trglang}:{text}' for text in texts]
+
+
+def test_output_order():
+    translators = [FakeTranslator('a', delay=0.002), FakeTranslator('b'), FakeTranslator('c', 0.001)]
+    router = RouterTranslator(translators, max_workers=4, chunk_size=7)
+    texts = [f'text {i}' for i in range(500)]
+    assert router.translate_sents(texts, 'en', 'de', quiet=True) == [f'de:{t}' for t in texts]
+    assert sum(stats['chunks'] for stats in router.stats().values()) == 72
+
+
+def test_failover():
+    down, up = FakeTranslator('down', fail=True), FakeTranslator('up')
+    router = RouterTranslator([down, up], max_workers=2, chunk_size=10, cooldown=60)
+    texts = [f'text {i}' for i in range(100)]
+    assert router.translate_sents(texts, 'en', 'de', quiet=True) == [f'de:{t}' for t in texts]
+    stats = router.stats()
+    assert stats['down']['failures'] >= 1 and stats['down']['chunks'] == 0
+    assert stats['up']['chars'] == sum(map(len, texts))
+    # Every translator failing raises the last error.
+    up.fail = True
+    with pytest.raises(ResponseError):
+        router.translate_sents(['x'], 'en', 'de', quiet=True)
+
+
+def test_quota_exhaustion():
+    limited, other = FakeTranslator('limited'), FakeTranslator('other')
+    router = RouterTranslator([limited, other], quotas={'limited': 25}, max_workers=1,
+                              chunk_size=2)
+    texts = [f'text{i}' for i in range(10)]
+    assert router.translate_sents(texts, 'en', 'de', quiet=True) == [f'de:{t}' for t in texts]
+    stats = router.stats()
+    assert stats['limited']['chars'] <= 25 and stats['limited']['remaining'] >= 0
+    assert stats['limited']['chars'] + stats['other']['chars'] == sum(map(len, texts))
+
+    router = RouterTranslator([FakeTranslator('limited')], quotas={'limited': 5}, chunk_size=2)
+    with pytest.raises(ResponseError, match='quota'):
+        router.translate_sents(['abc', 'def'], 'en', 'de', quiet=True)
+
+
+def test_hedging():
+    slow, fast = FakeTranslator('slow', delay=0.5), FakeTranslator('fast')
+    router = RouterTranslator([slow, fast], max_workers=1, hedge_after=0.05)
+    start = time.monotonic()
+    assert router.translate_sents(['a', 'b'], 'en', 'de', quiet=True) == ['de:a', 'de:b']
+    assert time.monotonic() - start < 0.4
+    assert router.stats()['fast']['hedges_won'] == 1
+    router.close()
+
+
+def test_same_provider_translators_are_kept_apart():
+    translators = [FakeTranslator('google'), FakeTranslator('google'), FakeTranslator('systran')]
+    router = RouterTranslator(translators, quotas={'google': 100, 'google-2': 50})
+    assert {name: stats['remaining'] for name, stats in router.stats().items()} == {
+        'google-1': 100, 'google-2': 50, 'systran': None}
+    router = RouterTranslator(translators[:2], names=['key1', 'key2'])
+    assert list(router.stats()) == ['key1', 'key2']
+    with pytest.raises(ValueError):
+        RouterTranslator(translators[:2], names=['key', 'key'])
@@ -0,0 +1,40 @@
+import pytest
+
+from aomame.segment import (chunk_text, join_segments, segment_text, split_long,
+                            split_sentences)
+
+DOCUMENT = ("First sentence. Second one!  A question?\nA quote.\" Then (brackets.) "
+            "日本語の文。次の文！終わり？ " + "word " * 300 + "x" * 250 + " trailing  ")
+
+
+def test_split_sentences_round_trip():
+    assert ''.join(split_sentences(DOCUMENT)) == DOCUMENT
+    assert split_sentences('One. Two.') == ['One. ', 'Two.']
+
+
+@pytest.mark.parametrize('max_chars', [1, 7, 50, 100, 10000])
+def test_segment_text_round_trip(max_chars):
+    segments = segment_text(DOCUMENT, max_chars)
+    assert ''.join(segments) == DOCUMENT
+    assert all(0 < len(segment) <= max_chars for segment in segments)
+
+
+def test_split_long_cuts_at_whitespace():
+    assert split_long('aaa bbb ccc', 8) == ['aaa bbb ', 'ccc']
+    assert split_long('abcdefgh', 3) == ['abc', 'def', 'gh']
+
+
+def test_join_segments_keeps_whitespace():
+    segments = segment_text(DOCUMENT, 100)
+    translations = [segment.strip().upper() for segment in segments]
+    joined = join_segments(segments, translations)
+    assert joined == ''.join(t + s[len(s.rstrip()):] for s, t in zip(segments, translations))
+    assert join_segments(segments, segments) == DOCUMENT
+
+
+@pytest.mark.parametrize('max_chars', [1, 30, 1000])
+def test_chunk_text_round_trip(max_chars):
+    chunks = chunk_text(DOCUMENT, max_chars)
+    assert ''.join(chunks) == DOCUMENT
+    assert all(0 < len(chunk) <= max_chars for chunk in chunks)
+    assert len(chunk_text(DOCUMENT, len(DOCUMENT))) == 1
@@ -0,0 +1,62 @@
+import argparse
+import multiprocessing
+import os
+import signal
+
+import pytest
+
+from aomame.bin import translate
+from aomame.bin.translate import output_paths, shard_offsets, shard_translate
+
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                                reason="the workers must inherit the fake translator")
+
+
+class UpperTranslator:
+    """Translates by upper-casing, killing its process on a line 'die'."""
+    def translate_sents(self, texts, srclang, trglang, quiet=False):
+        if 'die' in texts:
+            os.kill(os.getpid(), signal.SIGKILL)
+        return [f'{trglang}:{text.upper()}' for text in texts]
+
+    def translate_sents_multi(self, texts, srclang, trglangs, quiet=False):
+        return {trglang: self.translate_sents(texts, srclang, trglang) for trglang in trglangs}
+
+
+def run(tmp_path, monkeypatch, lines, tlangs, shards=3):
+    monkeypatch.setattr(translate, 'build_translator', lambda *args: UpperTranslator())
+    (tmp_path / 'in.txt').write_text(''.join(line + '\n' for line in lines), encoding='utf8')
+    args = argparse.Namespace(input_file=str(tmp_path / 'in.txt'),
+                              output_file=str(tmp_path / 'out.{tlang}'), slang='en', tlang=tlangs,
+                              shards=shards, workers=2, batch_size=4, metrics=None)
+    shard_translate(args, poll_interval=0.1)
+    return args
+
+
+def test_shard_offsets_split_on_line_starts():
+    data = b''.join(b'line %d\n' % i * (i % 5) for i in range(50))
+    for shards in 1, 2, 3, 7, 200:
+        offsets = shard_offsets(data, shards)
+        assert offsets[0] == 0 and offsets[-1] == len(data) and len(offsets) == shards + 1
+        assert offsets == sorted(offsets)
+        for offset in offsets[1:-1]:
+            assert offset == len(data) or data[offset - 1:offset] == b'\n'
+
+
+@pytest.mark.parametrize('tlangs', [['de'], ['de', 'fr']])
+def test_shards_stitch_in_order(tmp_path, monkeypatch, tlangs):
+    lines = [f'line {i} é' for i in range(101)]
+    args = run(tmp_path, monkeypatch, lines, tlangs)
+    for tlang, path in zip(tlangs, output_paths(args.output_file, tlangs)):
+        with open(path, encoding='utf8') as fin:
+            assert fin.read().splitlines() == [f'{tlang}:{line.upper()}' for line in lines]
+    assert sorted(os.listdir(tmp_path)) == sorted(['in.txt'] + [os.path.basename(path) for path in
+                                                   output_paths(args.output_file, tlangs)])
+
+
+def test_killed_shard_aborts(tmp_path, monkeypatch):
+    lines = [f'line {i}' for i in range(60)]
+    lines[45] = 'die'
+    with pytest.raises(SystemExit, match='exited with code'):
+        run(tmp_path, monkeypatch, lines, ['de'])
+    assert os.listdir(tmp_path) == ['in.txt']
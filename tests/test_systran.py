@@ -0,0 +1,23 @@
+import pytest
+
+from aomame.exceptions import ResponseError
+
+
+def test_input_error_isolates_items(make_systran):
+    systran = make_systran(400)
+    assert systran.translate_sents(['a', 'b', 'c'], 'en', 'de', quiet=True) == ['de:A', 'de:B', 'de:C']
+    assert systran.session.requests == [['a', 'b', 'c'], ['a'], ['b'], ['c']]
+
+
+@pytest.mark.parametrize('status', [408, 429, 500, 503])
+def test_other_errors_are_raised(make_systran, status):
+    systran = make_systran(status)
+    with pytest.raises(ResponseError):
+        systran.translate_sents(['a', 'b', 'c'], 'en', 'de', quiet=True)
+    assert systran.session.requests == [['a', 'b', 'c']]
+
+
+def test_translate_sents_multi(make_systran):
+    systran = make_systran()
+    assert systran.translate_sents_multi(['a', 'b'], 'en', ['de', 'fr'], quiet=True) == {
+        'de': ['de:A', 'de:B'], 'fr': ['fr:A', 'fr:B']}
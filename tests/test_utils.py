@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+from aomame.base import BaseTranslator
+from aomame.utils import (dedupe, split_workers, translate_detected_multi, translate_per_target,
+                          translate_unique)
+
+
+class TaggingTranslator(BaseTranslator):
+    """Detects the `[lang] ` prefix of a text, translates by adding one."""
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self.detected, self.translated = [], []
+
+    def detect_sents(self, texts, quiet=False, max_workers=None):
+        self.detected.append(list(texts))
+        return [t[1:3] if t.startswith('[') else 'en' if t.strip() else 'und' for t in texts]
+
+    def translate_sents(self, texts, srclang, trglang, quiet=False, max_workers=None,
+                        normalize_whitespace=False):
+        assert srclang != 'und'
+        self.translated.append((srclang, trglang, list(texts)))
+        return [f'[{trglang}] {t}' for t in texts]
+
+
+def test_dedupe():
+    assert dedupe(['a', 'b', 'a', 'a ']) == (['a', 'b', 'a '], [0, 1, 0, 2])
+    assert dedupe(['a', 'b', 'a', 'a '], normalize_whitespace=True) == (['a', 'b'], [0, 1, 0, 0])
+
+
+def test_translate_unique():
+    sent = []
+    translate = lambda uniques: sent.extend(uniques) or [t.upper() for t in uniques]
+    assert translate_unique(['ab', 'c', 'ab'], translate) == (['AB', 'C', 'AB'], 2)
+    assert sent == ['ab', 'c']
+
+
+def test_translate_detected_multi_detects_once():
+    translator = TaggingTranslator()
+    texts = ['hello', '[fr] bonjour', '[de] hallo', 'world']
+    results = translator.translate_sents_multi(texts, 'auto', ['de', 'fr'])
+    assert results == {'de': ['[de] hello', '[de] [fr] bonjour', '[de] hallo', '[de] world'],
+                       'fr': ['[fr] hello', '[fr] bonjour', '[fr] [de] hallo', '[fr] world']}
+    assert translator.detected == [texts]
+    assert sorted(translator.translated) == [
+        ('de', 'fr', ['[de] hallo']), ('en', 'de', ['hello', 'world']),
+        ('en', 'fr', ['hello', 'world']), ('fr', 'de', ['[fr] bonjour'])]
+
+
+def test_translate_detected_multi_keeps_undetermined():
+    translator = TaggingTranslator()
+    assert translator.translate_sents_multi(['hello', ' ', ''], 'auto', ['de', 'fr']) == {
+        'de': ['[de] hello', ' ', ''], 'fr': ['[fr] hello', ' ', '']}
+
+
+def test_translate_detected_multi_shares_max_workers():
+    translator = TaggingTranslator(max_workers=4)
+    lock, inflight, peak = threading.Lock(), [0], [0]
+    translate_sents = translator.translate_sents
+
+    def counting_translate_sents(*args, max_workers=None, **kwargs):
+        with lock:
+            inflight[0] += max_workers
+            peak[0] = max(peak[0], inflight[0])
+        time.sleep(0.01)
+        with lock:
+            inflight[0] -= max_workers
+        return translate_sents(*args, **kwargs)
+
+    translator.translate_sents = counting_translate_sents
+    texts = [f'[{lang}] x' for lang in ['fr', 'de', 'ja', 'ko', 'es']] + ['hello']
+    results = translate_detected_multi(translator, texts, ['it', 'pt', 'nl'])
+    assert results['pt'] == [f'[pt] {text}' for text in texts]
+    assert peak[0] <= 4
+
+
+def test_translate_sents_auto_keeps_target_language():
+    translator = TaggingTranslator()
+    assert translate_detected_multi(translator, ['[de] a', 'b'], ['de']) == {'de': ['[de] a', '[de] b']}
+    assert translator.translated == [('en', 'de', ['b'])]
+
+
+@pytest.mark.parametrize('max_workers, tasks', [(1, 1), (1, 8), (4, 8), (4, 3), (8, 3), (None, 2)])
+def test_split_workers(max_workers, tasks):
+    concurrent, workers = split_workers(max_workers, tasks)
+    assert 1 <= concurrent <= tasks and workers >= 1
+    assert concurrent * workers <= (max_workers or 1)
+
+
+def test_translate_per_target_shares_max_workers():
+    lock, inflight, peak = threading.Lock(), [0], [0]
+
+    def translate_sents(texts, srclang, trglang, max_workers):
+        with lock:
+            inflight[0] += max_workers
+            peak[0] = max(peak[0], inflight[0])
+        time.sleep(0.01)
+        with lock:
+            inflight[0] -= max_workers
+        return [f'[{trglang}] {t}' for t in texts]
+
+    trglangs = ['de', 'fr', 'ja', 'ko', 'es', 'it', 'pt', 'nl']
+    results = translate_per_target(translate_sents, ['a'], 'en', trglangs, max_workers=4)
+    assert results == {trglang: [f'[{trglang}] a'] for trglang in trglangs}
+    assert peak[0] == 4